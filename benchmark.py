@@ -0,0 +1,354 @@
+"""Microbenchmarks for the client's hot paths.
+
+Run:
+    python benchmark.py                       # run everything, check thresholds
+    python benchmark.py --json results.json   # also save machine-readable results
+    python benchmark.py --compare old.json    # show change against an earlier run
+    python benchmark.py --profile cprofile    # write .prof + folded stacks per benchmark
+    python benchmark.py --profile tracemalloc # write folded allocation stacks
+
+create_torrent_256m vs read_dataset_256m shows whether torrent creation keeps
+up with plain sequential reads of the same data (i.e. is I/O bound, not CPU bound).
+
+Folded stack files (*.folded) can be fed straight to flamegraph.pl or speedscope.
+Exit code is 1 when a benchmark is slower than its threshold; thresholds are
+set for --scale 1 and scaled proportionally with --scale.
+"""
+import argparse
+import contextlib
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import bencodepy
+
+from torrent_client import PeerProtocol, PieceManager, TorrentCreator, TorrentParser, Tracker
+
+# Best-of-N time limits in seconds, generous enough for slow CI machines
+THRESHOLDS = {
+    'parse_huge_torrent': 3.0,
+    'info_hash_huge_torrent': 1.5,
+    'piece_hashes_1m': 1.0,
+    'parse_peers_compact_50k': 0.5,
+    'handshake_pack_unpack_100k': 1.0,
+    'message_framing_100k': 1.0,
+    'piece_manager_init_1m': 4.0,
+    'piece_manager_bookkeeping_1m': 4.0,
+    'read_dataset_256m': 2.0,
+    'create_torrent_256m': 4.0,
+}
+
+
+def make_huge_torrent(path, num_pieces, num_files, piece_length=16384):
+    """Write a synthetic multi-file torrent with `num_pieces` SHA-1 hashes"""
+    total = num_pieces * piece_length
+    file_length = total // num_files
+    files = [{b'path': [b'dir%d' % (i % 100), b'file%d.bin' % i], b'length': file_length}
+             for i in range(num_files - 1)]
+    files.append({b'path': [b'last.bin'], b'length': total - file_length * (num_files - 1)})
+    metadata = {
+        b'announce': b'http://127.0.0.1:6969/announce',
+        b'info': {
+            b'name': b'benchmark',
+            b'piece length': piece_length,
+            b'pieces': os.urandom(20 * num_pieces),
+            b'files': files,
+        }
+    }
+    with open(path, 'wb') as f:
+        f.write(bencodepy.encode(metadata))
+
+
+def make_dataset(path, total_size, num_files=4):
+    """Random files to build a torrent from; returns the number of bytes written"""
+    os.makedirs(path, exist_ok=True)
+    chunk = os.urandom(4 * 1024 * 1024)
+    file_size = total_size // num_files
+    for i in range(num_files):
+        with open(os.path.join(path, f'part{i}.bin'), 'wb') as f:
+            remaining = file_size
+            while remaining > 0:
+                remaining -= f.write(chunk[:remaining])
+    return file_size * num_files
+
+
+class Fixtures:
+    def __init__(self, scale, with_dataset=True):
+        self.tmpdir = tempfile.mkdtemp(prefix='torrent-bench-')
+        try:
+            self.num_pieces = int(1_000_000 * scale)
+            self.torrent_path = os.path.join(self.tmpdir, 'huge.torrent')
+            make_huge_torrent(self.torrent_path, self.num_pieces, max(1, int(10_000 * scale)))
+            self.parser = TorrentParser(self.torrent_path)
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.parser.parse()
+            self.peers_data = os.urandom(6 * int(50_000 * scale))
+            self.messages = int(100_000 * scale)
+            # 256 MB at scale 1: only written when a dataset benchmark is selected
+            self.dataset_dir = os.path.join(self.tmpdir, 'dataset')
+            self.dataset_size = make_dataset(self.dataset_dir, int(256 * 1024 * 1024 * scale)) if with_dataset else 0
+        except BaseException:
+            self.cleanup()
+            raise
+
+    def cleanup(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+def bench_parse_huge_torrent(fx):
+    parser = TorrentParser(fx.torrent_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return parser.parse()
+
+
+def bench_info_hash_huge_torrent(fx):
+    fx.parser.info_hash = None  # get_info_hash caches; time the encode + SHA-1, not the cache hit
+    return fx.parser.get_info_hash()
+
+
+def bench_piece_hashes_1m(fx):
+    return fx.parser.get_piece_hashes()
+
+
+def bench_parse_peers_compact_50k(fx):
+    tracker = Tracker(fx.parser)
+    tracker.parse_peers(fx.peers_data)
+    return tracker.peers
+
+
+def bench_handshake_pack_unpack_100k(fx):
+    protocol = PeerProtocol(os.urandom(20), '-PC0001-123456789012')
+    for _ in range(fx.messages):
+        PeerProtocol.parse_handshake(protocol.build_handshake())
+
+
+def bench_message_framing_100k(fx):
+    block = bytes(16384)
+    for i in range(fx.messages):
+        request = PeerProtocol.build_request(i, 16384, 16384)
+        PeerProtocol.parse_message(request[4:])
+        piece = struct.pack('>IBII', 9 + len(block), 7, i, 0) + block
+        message_id, payload = PeerProtocol.parse_message(piece[4:])
+        PeerProtocol.parse_piece(payload)
+
+
+def bench_piece_manager_init_1m(fx):
+    return PieceManager(fx.parser)
+
+
+def bench_piece_manager_bookkeeping_1m(fx):
+    manager = PieceManager(fx.parser)
+    for _ in range(100):
+        for piece_index in manager.pick_pieces(10):
+            manager.claim_piece(piece_index)
+            if manager.mark_block_received(piece_index, 0, manager.pieces[piece_index]['size']):
+                manager.mark_piece_verified(piece_index)
+    manager.all_wanted_downloaded()
+    manager.set_file_priority(0, 0)
+    return manager
+
+
+def bench_read_dataset_256m(fx):
+    """Baseline: sequential reads of the dataset, what torrent creation should keep up with"""
+    buffer = bytearray(4 * 1024 * 1024)
+    for name in sorted(os.listdir(fx.dataset_dir)):
+        with open(os.path.join(fx.dataset_dir, name), 'rb', buffering=0) as f:
+            while f.readinto(buffer):
+                pass
+
+
+def bench_create_torrent_256m(fx):
+    return TorrentCreator(fx.dataset_dir, ['http://127.0.0.1:6969/announce']).build()
+
+
+BENCHMARKS = [
+    bench_parse_huge_torrent,
+    bench_info_hash_huge_torrent,
+    bench_piece_hashes_1m,
+    bench_parse_peers_compact_50k,
+    bench_handshake_pack_unpack_100k,
+    bench_message_framing_100k,
+    bench_piece_manager_init_1m,
+    bench_piece_manager_bookkeeping_1m,
+    bench_read_dataset_256m,
+    bench_create_torrent_256m,
+]
+
+# Benchmarks that need the dataset written to disk first
+DATASET_BENCHMARKS = {'read_dataset_256m', 'create_torrent_256m'}
+
+# Benchmarks that move data report throughput too
+BENCHMARK_BYTES = {
+    'read_dataset_256m': lambda fx: fx.dataset_size,
+    'create_torrent_256m': lambda fx: fx.dataset_size,
+}
+
+
+def run_benchmark(func, fx, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(fx)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def write_cprofile(func, fx, out_dir, name):
+    profiler = cProfile.Profile()
+    profiler.runcall(func, fx)
+    profiler.dump_stats(os.path.join(out_dir, f'{name}.prof'))
+    write_folded_from_pstats(pstats.Stats(profiler), os.path.join(out_dir, f'{name}.folded'))
+
+
+def write_folded_from_pstats(stats, path):
+    """Approximate folded stacks from cProfile's caller graph (self time in microseconds)"""
+    def label(func):
+        filename, line, name = func
+        return f'{name} ({os.path.basename(filename)}:{line})'
+
+    children = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+    roots = [func for func, data in stats.stats.items() if not data[4]]
+
+    lines = {}
+
+    def walk(func, stack, fraction):
+        cc, nc, tt, ct, callers = stats.stats[func]
+        stack = stack + [label(func)]
+        self_time = int(tt * fraction * 1e6)
+        if self_time:
+            key = ';'.join(stack)
+            lines[key] = lines.get(key, 0) + self_time
+        for child, edge_ct in children.get(func, []):
+            if label(child) in stack:
+                continue  # Recursion
+            child_ct = stats.stats[child][3]
+            share = edge_ct / child_ct if child_ct else 0
+            walk(child, stack, fraction * share)
+
+    for root in roots:
+        walk(root, [], 1.0)
+    with open(path, 'w') as f:
+        for stack, value in sorted(lines.items()):
+            f.write(f'{stack} {value}\n')
+
+
+def write_tracemalloc(func, fx, out_dir, name):
+    """Folded allocation stacks (bytes still allocated when the benchmark returns)"""
+    tracemalloc.start(32)
+    result = func(fx)  # Keep the result alive so its allocations show up
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del result
+    with open(os.path.join(out_dir, f'{name}.alloc.folded'), 'w') as f:
+        for stat in snapshot.statistics('traceback'):
+            frames = [f'{os.path.basename(frame.filename)}:{frame.lineno}' for frame in stat.traceback]
+            f.write(f"{';'.join(frames)} {stat.size}\n")
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(args, fx, selected):
+    """Run the selected benchmarks, print and save results; returns the names over threshold"""
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+    if args.profile:
+        os.makedirs(args.profile_dir, exist_ok=True)
+
+    results = {}
+    failed = []
+    for func in selected:
+        name = func.__name__[len('bench_'):]
+        timings = run_benchmark(func, fx, args.repeat)
+        best = min(timings)
+        # Thresholds are for the full-size inputs; the work grows linearly with --scale
+        threshold = THRESHOLDS[name] * args.scale
+        ok = best <= threshold
+        results[name] = {
+            'best_s': best,
+            'mean_s': sum(timings) / len(timings),
+            'repeat': args.repeat,
+            'threshold_s': threshold,
+            'ok': ok,
+        }
+        line = f"{'✅' if ok else '❌'} {name:32s} {best * 1000:10.2f} ms  (limit {threshold * 1000:.0f} ms)"
+        if name in BENCHMARK_BYTES:
+            results[name]['mb_per_s'] = BENCHMARK_BYTES[name](fx) / best / 1024 / 1024
+            line += f"  {results[name]['mb_per_s']:.0f} MB/s"
+        if name in previous:
+            change = (best / previous[name]['best_s'] - 1) * 100
+            line += f'  {change:+.1f}% vs previous'
+        print(line)
+        if not ok:
+            failed.append(name)
+
+        if args.profile == 'cprofile':
+            write_cprofile(func, fx, args.profile_dir, name)
+        elif args.profile == 'tracemalloc':
+            write_tracemalloc(func, fx, args.profile_dir, name)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': get_commit(),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'timestamp': time.time(),
+                'scale': args.scale,
+                'results': results,
+            }, f, indent=2)
+        print(f'📄 Results written to {args.json}')
+    if args.profile:
+        print(f'🔥 Profiles written to {args.profile_dir}/')
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks for torrent_client')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark (best is reported)')
+    parser.add_argument('--scale', type=float, default=1.0, help='shrink/grow the synthetic inputs')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--json', help='write results to this JSON file')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    parser.add_argument('--profile', choices=['cprofile', 'tracemalloc'], help='also write profiles')
+    parser.add_argument('--profile-dir', default='bench_profiles')
+    args = parser.parse_args()
+
+    selected = [func for func in BENCHMARKS if args.filter in func.__name__[len('bench_'):]]
+    with_dataset = any(func.__name__[len('bench_'):] in DATASET_BENCHMARKS for func in selected)
+    print(f'Preparing fixtures (scale {args.scale})...')
+    fx = Fixtures(args.scale, with_dataset)
+    try:
+        failed = run_benchmarks(args, fx, selected)
+    finally:
+        fx.cleanup()  # The dataset alone is 256 MB at scale 1
+
+    if failed:
+        print(f"❌ Over threshold: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""FileWriter tests: pieces split across files, skipped files kept in the partfile"""
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import torrent_client as tc
+
+
+class FileWriterTest(unittest.TestCase):
+    # 32 KiB pieces: piece 1 spans a.bin/b.bin, piece 2 spans b.bin/c.bin
+    FILE_SIZES = {'a.bin': 50000, 'b.bin': 30000, 'c.bin': 20000}
+    PIECE_LENGTH = 32768
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='file-writer-test-')
+        self.source = os.path.join(self.tmpdir, 'multi')
+        os.makedirs(self.source)
+        for name, size in self.FILE_SIZES.items():
+            with open(os.path.join(self.source, name), 'wb') as f:
+                f.write(os.urandom(size))
+        torrent_path = os.path.join(self.tmpdir, 'multi.torrent')
+        with contextlib.redirect_stdout(io.StringIO()):
+            tc.TorrentCreator(self.source, piece_length=self.PIECE_LENGTH).save(torrent_path)
+            self.parser = tc.TorrentParser(torrent_path)
+            self.parser.parse()
+        self.piece_manager = tc.PieceManager(self.parser)
+        self.download_path = os.path.join(self.tmpdir, 'downloads')
+        self.file_writer = tc.FileWriter(self.parser, self.download_path, None, self.piece_manager)
+        self.stream = b''.join(self.read_source(file['path']) for file in self.parser.get_files())
+
+    def tearDown(self):
+        self.file_writer.close()
+        shutil.rmtree(self.tmpdir)
+
+    def read_source(self, path):
+        with open(os.path.join(self.source, os.path.basename(path)), 'rb') as f:
+            return f.read()
+
+    def downloaded(self, name):
+        return os.path.join(self.download_path, 'multi', name)
+
+    def write_all(self, block=10000):
+        # Blocks that straddle file and piece boundaries
+        for offset in range(0, len(self.stream), block):
+            self.file_writer.write_piece(offset // self.PIECE_LENGTH, self.stream[offset:offset + block], offset)
+
+    def test_write_and_read_across_file_boundaries(self):
+        self.file_writer.initialize_file()
+        self.write_all()
+        self.assertEqual(self.file_writer.read_data(0, len(self.stream)), self.stream)
+        for offset in (self.PIECE_LENGTH, 2 * self.PIECE_LENGTH):
+            self.assertEqual(self.file_writer.read_data(offset, self.PIECE_LENGTH),
+                             self.stream[offset:offset + self.PIECE_LENGTH])
+        # Reads past the end of the torrent come back as zeros
+        self.assertEqual(self.file_writer.read_data(len(self.stream) - 10, 20), self.stream[-10:] + bytes(10))
+        self.file_writer.close()
+        for name in self.FILE_SIZES:
+            with open(self.downloaded(name), 'rb') as f:
+                self.assertEqual(f.read(), self.read_source(name), name)
+        self.assertFalse(os.path.exists(self.file_writer.part_path))
+
+    def test_skipped_file_goes_to_partfile(self):
+        self.piece_manager.set_file_priority(1, tc.FILE_PRIORITY_SKIP)  # b.bin
+        self.file_writer.initialize_file()
+        self.write_all()
+        self.assertFalse(os.path.exists(self.downloaded('b.bin')))
+        self.assertTrue(os.path.exists(self.file_writer.part_path))
+        self.assertEqual(sorted(self.file_writer.part_slots), [1, 2])
+        # Pieces still verify: the skipped file's part is read from the partfile
+        self.assertEqual(self.file_writer.read_data(0, len(self.stream)), self.stream)
+        self.file_writer.close()
+        self.assertFalse(os.path.exists(self.downloaded('b.bin')))
+        self.assertFalse(os.path.exists(self.file_writer.part_path))
+
+    def test_apply_priorities_moves_partfile_data(self):
+        self.piece_manager.set_file_priority(1, tc.FILE_PRIORITY_SKIP)
+        self.file_writer.initialize_file()
+        self.write_all()
+        self.piece_manager.set_file_priority(1, tc.FILE_PRIORITY_NORMAL)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.file_writer.apply_priorities()
+        with open(self.downloaded('b.bin'), 'rb') as f:
+            self.assertEqual(f.read(), self.read_source('b.bin'))
+        self.assertEqual(self.file_writer.read_data(0, len(self.stream)), self.stream)
+        self.file_writer.close()
+        self.assertFalse(os.path.exists(self.file_writer.part_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""Local Service Discovery (BEP 14) tests: two instances finding each other over loopback multicast"""
+import asyncio
+import os
+import unittest
+
+import torrent_client as tc
+
+
+class LocalServiceDiscoveryTest(unittest.TestCase):
+    INFO_HASH = bytes.fromhex('0123456789abcdef0123456789abcdef01234567')
+
+    def test_parse_announce(self):
+        lsd = tc.LocalServiceDiscovery([self.INFO_HASH], 6881, None)
+        port, info_hashes, cookie = tc.LocalServiceDiscovery.parse_announce(lsd.build_announce(tc.LSD_GROUP_IPV4))
+        self.assertEqual(port, 6881)
+        self.assertEqual(info_hashes, [self.INFO_HASH.hex()])
+        self.assertEqual(cookie, lsd.cookie)
+        self.assertIsNone(tc.LocalServiceDiscovery.parse_announce(b'NOTIFY * HTTP/1.1\r\nPort: 1\r\n\r\n'))
+        self.assertIsNone(tc.LocalServiceDiscovery.parse_announce(b'BT-SEARCH * HTTP/1.1\r\nPort: 1\r\n\r\n'))
+
+    def test_two_instances_discover_each_other(self):
+        found = asyncio.run(self.discover())
+        if found is None:
+            self.skipTest("no multicast on the loopback interface")
+        # Each side hears the other once (IPv4 or IPv6 group, whichever came first), never itself
+        self.assertEqual([(port, info_hash) for _, port, info_hash in found[0]], [(7002, self.INFO_HASH)])
+        self.assertEqual([(port, info_hash) for _, port, info_hash in found[1]], [(7001, self.INFO_HASH)])
+
+    async def discover(self):
+        found = ([], [])
+        first = tc.LocalServiceDiscovery([self.INFO_HASH], 7001, lambda *peer: found[0].append(peer), '127.0.0.1')
+        second = tc.LocalServiceDiscovery([self.INFO_HASH, os.urandom(20)], 7002,
+                                          lambda *peer: found[1].append(peer), '127.0.0.1')
+        try:
+            if not await first.start() or not await second.start():
+                return None
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                if found[0] and found[1]:
+                    break
+            if not found[0] and not found[1]:
+                return None
+            return found
+        finally:
+            first.close()
+            second.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
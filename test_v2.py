@@ -0,0 +1,234 @@
+"""BitTorrent v2 (BEP 52) tests: Merkle helpers, piece info, verification and hash answers"""
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import bencodepy
+
+import torrent_client as tc
+
+PIECE_LENGTH = 32768  # Two 16 KiB blocks per piece
+BLOCK = tc.MERKLE_BLOCK_SIZE
+
+
+def sha256(data):
+    return hashlib.sha256(data).digest()
+
+
+def tree_root(leaves, width, pad=bytes(32)):
+    """Naive Merkle root, independent of tc.merkle_root"""
+    layer = list(leaves) + [pad] * (width - len(leaves))
+    while len(layer) > 1:
+        layer = [sha256(layer[i] + layer[i + 1]) for i in range(0, len(layer), 2)]
+    return layer[0]
+
+
+def file_hashes(data):
+    """(leaf hashes, piece layer, pieces root) of one file"""
+    blocks_per_piece = PIECE_LENGTH // BLOCK
+    leaves = [sha256(data[offset:offset + BLOCK]) for offset in range(0, len(data), BLOCK)]
+    count = -(-len(data) // PIECE_LENGTH)
+    if count == 1:
+        root = tree_root(leaves, tc.next_power_of_two(len(leaves)))
+        return leaves, [root], root
+    layer = [tree_root(leaves[n * blocks_per_piece:(n + 1) * blocks_per_piece], blocks_per_piece)
+             for n in range(count)]
+    return leaves, layer, tree_root(leaves, tc.next_power_of_two(count) * blocks_per_piece)
+
+
+def make_v2_torrent(path, files, hybrid=False, piece_layers=True):
+    """Write a v2 (or hybrid) torrent for {name: data}; returns the piece stream and per-file hashes"""
+    tree, layers, hashes, v1_files = {}, {}, {}, []
+    stream = bytearray()
+    names = sorted(files)
+    last = max(position for position, name in enumerate(names) if files[name])
+    for position, name in enumerate(names):
+        data = files[name]
+        if not data:
+            tree[name.encode()] = {b'': {b'length': 0}}
+            v1_files.append({b'path': [name.encode()], b'length': 0})
+            continue
+        leaves, layer, root = file_hashes(data)
+        hashes[name] = (leaves, layer, root)
+        tree[name.encode()] = {b'': {b'length': len(data), b'pieces root': root}}
+        if len(layer) > 1 and piece_layers:
+            layers[root] = b''.join(layer)
+        v1_files.append({b'path': [name.encode()], b'length': len(data)})
+        stream += data
+        pad = -len(data) % PIECE_LENGTH
+        if pad and position < last:
+            # Pure v2 aligns files implicitly; hybrid torrents use BEP 47 pad files
+            stream += bytes(pad)
+            if hybrid:
+                v1_files.append({b'path': [b'.pad', str(pad).encode()], b'length': pad, b'attr': b'p'})
+    info = {b'name': b'v2test', b'piece length': PIECE_LENGTH, b'meta version': 2, b'file tree': tree}
+    if hybrid:
+        info[b'files'] = v1_files
+        info[b'pieces'] = b''.join(hashlib.sha1(bytes(stream[offset:offset + PIECE_LENGTH])).digest()
+                                   for offset in range(0, len(stream), PIECE_LENGTH))
+    metadata = {b'announce': b'http://127.0.0.1:6969/announce', b'info': info}
+    if layers:
+        metadata[b'piece layers'] = layers
+    with open(path, 'wb') as f:
+        f.write(bencodepy.encode(metadata))
+    return bytes(stream), hashes
+
+
+class MerkleTest(unittest.TestCase):
+    def test_merkle_root_matches_naive_tree(self):
+        leaves = [sha256(bytes([n])) for n in range(5)]
+        self.assertEqual(tc.merkle_root(leaves, 8), tree_root(leaves, 8))
+        self.assertEqual(tc.merkle_root(leaves[:1], 1), leaves[0])
+        pad = tc.zero_subtree_hash(1)
+        self.assertEqual(pad, sha256(bytes(64)))
+        self.assertEqual(tc.merkle_root(leaves[:3], 4, pad), tree_root(leaves[:3], 4, pad))
+
+    def test_merkle_verify_proof(self):
+        leaves = [sha256(bytes([n])) for n in range(8)]
+        root = tree_root(leaves, 8)
+        layers = [leaves]
+        while len(layers[-1]) > 1:
+            layer = layers[-1]
+            layers.append([sha256(layer[i] + layer[i + 1]) for i in range(0, len(layer), 2)])
+        for position, leaf in enumerate(leaves):
+            proof = [layers[level][(position >> level) ^ 1] for level in range(3)]
+            self.assertTrue(tc.merkle_verify_proof(leaf, position, proof, root))
+            self.assertFalse(tc.merkle_verify_proof(leaf, position ^ 1, proof, root))
+
+
+class V2TorrentTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='v2-test-')
+        self.files = {'a.bin': os.urandom(80000), 'b.bin': os.urandom(20000), 'c.bin': b''}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def load(self, **options):
+        path = os.path.join(self.tmpdir, 'v2.torrent')
+        stream, hashes = make_v2_torrent(path, self.files, **options)
+        parser = tc.TorrentParser(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            parser.parse()
+            piece_manager = tc.PieceManager(parser)
+        return parser, piece_manager, stream, hashes
+
+    def receive_piece(self, piece_manager, piece_index):
+        size = piece_manager.pieces[piece_index]['size']
+        for begin in range(0, size, BLOCK):
+            piece_manager.mark_block_received(piece_index, begin, min(BLOCK, size - begin))
+
+    def piece_data(self, piece_manager, stream, piece_index):
+        start = piece_index * PIECE_LENGTH
+        return stream[start:start + piece_manager.pieces[piece_index]['size']]
+
+    def test_pure_v2_piece_info(self):
+        parser, piece_manager, stream, hashes = self.load()
+        self.assertTrue(parser.is_v2())
+        self.assertFalse(parser.is_hybrid())
+        info = parser.get_v2_piece_info()
+        # a.bin: pieces 0-2 from its piece layer; b.bin: one piece whose hash is the pieces root
+        self.assertEqual([info[n]['hash_v2'] for n in range(3)], hashes['a.bin'][1])
+        self.assertEqual(info[3]['hash_v2'], hashes['b.bin'][2])
+        self.assertEqual(info[3]['width'], 2)
+        # No padding on the wire in v2-only swarms
+        self.assertEqual([piece['size'] for piece in piece_manager.pieces], [32768, 32768, 80000 - 65536, 20000])
+        for piece_index in range(4):
+            result = piece_manager.check_piece(piece_index, self.piece_data(piece_manager, stream, piece_index))
+            self.assertEqual(piece_manager.apply_verification(piece_index, result), 'verified')
+        self.assertTrue(piece_manager.all_wanted_downloaded())
+
+    def test_piece_layer_that_does_not_match_root_is_ignored(self):
+        leaves, layer, root = file_hashes(self.files['a.bin'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(tc.TorrentParser.get_piece_layer(None, b''.join(reversed(layer)), root, 3, 2),
+                             [None] * 3)
+        self.assertEqual(tc.TorrentParser.get_piece_layer(None, b''.join(layer), root, 3, 2), layer)
+
+    def test_corrupt_block_is_pinpointed_with_leaf_hashes(self):
+        parser, piece_manager, stream, hashes = self.load()
+        self.receive_piece(piece_manager, 1)
+        data = bytearray(self.piece_data(piece_manager, stream, 1))
+        data[BLOCK + 5] ^= 0xff  # Second block of piece 1
+        result = piece_manager.check_piece(1, bytes(data))
+        self.assertEqual(piece_manager.apply_verification(1, result), 'need_hashes')
+
+        root, base_layer, index, length, proof_layers = piece_manager.get_block_hash_request(1)
+        self.assertEqual((root, base_layer, index, length, proof_layers), (hashes['a.bin'][2], 0, 2, 2, 0))
+        leaves = hashes['a.bin'][0][index:index + length]
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Leaf hashes that don't add up to the piece hash are refused
+            self.assertEqual(piece_manager.handle_hashes(root, 0, index, length, leaves[::-1], []), [])
+            self.assertFalse(piece_manager.orphan_blocks)
+            self.assertEqual(piece_manager.handle_hashes(root, 0, index, length, leaves, []), [])
+        # Only the corrupt block is fetched again
+        self.assertEqual(list(piece_manager.orphan_blocks), [(1, BLOCK, BLOCK)])
+        self.assertFalse(piece_manager.is_block_received(1, BLOCK, BLOCK))
+        self.assertTrue(piece_manager.is_block_received(1, 0, BLOCK))
+        # With the leaf hashes known, later checks name the bad blocks directly
+        result = piece_manager.check_piece(1, bytes(data))
+        self.assertEqual(result['bad_blocks'], [1])
+        result = piece_manager.check_piece(1, self.piece_data(piece_manager, stream, 1))
+        self.assertEqual(piece_manager.apply_verification(1, result), 'verified')
+
+    def test_hybrid_pieces_with_pad_files(self):
+        parser, piece_manager, stream, hashes = self.load(hybrid=True)
+        self.assertTrue(parser.is_hybrid())
+        self.assertEqual([f['pad'] for f in parser.get_files()], [False, True, False, False])
+        # Hybrid pieces are cut from the padded v1 stream, pad bytes included
+        self.assertEqual([piece['size'] for piece in piece_manager.pieces],
+                         [32768] * 3 + [len(stream) - 3 * 32768])
+        self.assertEqual(parser.get_v2_piece_info()[3]['hash_v2'], hashes['b.bin'][2])
+        for piece_index in range(len(piece_manager.pieces)):
+            result = piece_manager.check_piece(piece_index, self.piece_data(piece_manager, stream, piece_index))
+            self.assertEqual(piece_manager.apply_verification(piece_index, result), 'verified', piece_index)
+        # A corrupt byte in the data part of a piece that ends in padding still fails
+        data = bytearray(self.piece_data(piece_manager, stream, 2))
+        data[0] ^= 0xff
+        self.assertFalse(piece_manager.check_piece(2, bytes(data))['ok'])
+
+    def test_missing_piece_layer_requested_from_peers(self):
+        parser, piece_manager, stream, hashes = self.load(piece_layers=False)
+        leaves, layer, root = hashes['a.bin']
+        self.assertEqual(piece_manager.missing_layers, {root: 3})
+        # Complete pieces wait for their piece hash
+        self.receive_piece(piece_manager, 0)
+        result = piece_manager.check_piece(0, self.piece_data(piece_manager, stream, 0))
+        self.assertEqual(piece_manager.apply_verification(0, result), 'waiting')
+        self.assertEqual(piece_manager.awaiting_hashes, {0})
+
+        requests = piece_manager.get_layer_hash_requests()
+        self.assertEqual(requests, [(root, 1, 0, 4, 0)])  # Base layer 1: two leaves per piece
+        root, base_layer, index, length, proof_layers = requests[0]
+        answer = layer + [tc.zero_subtree_hash(base_layer)] * (length - len(layer))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(piece_manager.handle_hashes(root, base_layer, index, length, answer[::-1], []), [])
+            self.assertIn(root, piece_manager.missing_layers)
+            ready = piece_manager.handle_hashes(root, base_layer, index, length, answer, [])
+        self.assertEqual(ready, [0])
+        self.assertEqual(piece_manager.missing_layers, {})
+        self.assertEqual([piece_manager.pieces[n]['v2']['hash_v2'] for n in range(3)], layer)
+        result = piece_manager.check_piece(0, self.piece_data(piece_manager, stream, 0))
+        self.assertEqual(piece_manager.apply_verification(0, result), 'verified')
+
+    def test_piece_layer_chunk_with_uncle_hashes(self):
+        # Eight pieces, answered as two chunks of four with one uncle hash each
+        self.files = {'big.bin': os.urandom(8 * PIECE_LENGTH)}
+        parser, piece_manager, stream, hashes = self.load(piece_layers=False)
+        leaves, layer, root = hashes['big.bin']
+        base_layer = 1
+        half = [tree_root(layer[:4], 4), tree_root(layer[4:], 4)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(piece_manager.handle_hashes(root, base_layer, 4, 4, layer[4:], [half[1]]), [])
+            self.assertIsNone(piece_manager.pieces[4]['v2']['hash_v2'])
+            piece_manager.handle_hashes(root, base_layer, 4, 4, layer[4:], [half[0]])
+        self.assertEqual([piece['v2']['hash_v2'] for piece in piece_manager.pieces[4:]], layer[4:])
+        self.assertIn(root, piece_manager.missing_layers)  # First half still unknown
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+"""Web seed (BEP 19) tests against a local HTTP server with Range support"""
+import asyncio
+import functools
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import torrent_client as tc
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    """Static files with single-range GETs, or plain 200 answers when ignore_range is set"""
+    protocol_version = 'HTTP/1.1'
+    ignore_range = False
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        range_header = self.headers.get('Range')
+        if range_header and not self.ignore_range:
+            start, end = (int(value) for value in range_header.split('=')[1].split('-'))
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{start + len(body) - 1}/{len(data)}')
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except OSError:
+            pass  # Client stopped reading an ignored range
+
+
+class NoRangeHandler(RangeHandler):
+    ignore_range = True
+
+
+class WebSeedTest(unittest.TestCase):
+    FILE_SIZES = {'a.bin': 100000, 'b.bin': 70000, 'c.bin': 5}
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='web-seed-test-')
+        self.source = os.path.join(self.tmpdir, 'served', 'multi')
+        os.makedirs(self.source)
+        for name, size in self.FILE_SIZES.items():
+            with open(os.path.join(self.source, name), 'wb') as f:
+                f.write(os.urandom(size))
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def serve(self, handler):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(handler, directory=os.path.dirname(self.source)))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers.append(server)
+        return f'http://127.0.0.1:{server.server_address[1]}/'
+
+    def make_parser(self, url):
+        torrent_path = os.path.join(self.tmpdir, 'multi.torrent')
+        tc.TorrentCreator(self.source, web_seeds=[url], piece_length=32768).save(torrent_path)
+        parser = tc.TorrentParser(torrent_path)
+        parser.parse()
+        return parser
+
+    def test_download_from_web_seed(self):
+        url = self.serve(RangeHandler)
+        parser = self.make_parser(url)
+        piece_manager = tc.PieceManager(parser)
+        download_path = os.path.join(self.tmpdir, 'downloads')
+        file_writer = tc.FileWriter(parser, download_path, None, piece_manager)
+        file_writer.initialize_file()
+        web_seed = tc.WebSeed(url, parser, piece_manager, file_writer)
+        try:
+            asyncio.run(asyncio.wait_for(web_seed.run(), timeout=30))
+        finally:
+            file_writer.close()
+
+        self.assertTrue(piece_manager.all_wanted_downloaded())
+        for name in self.FILE_SIZES:
+            with open(os.path.join(self.source, name), 'rb') as expected, \
+                    open(os.path.join(download_path, 'multi', name), 'rb') as got:
+                self.assertEqual(got.read(), expected.read(), name)
+
+    def test_server_ignoring_range(self):
+        url = self.serve(NoRangeHandler)
+        parser = self.make_parser(url)
+        web_seed = tc.WebSeed(url, parser, None)
+        file = parser.get_files()[0]
+        with open(os.path.join(self.source, 'a.bin'), 'rb') as f:
+            data = f.read()
+        try:
+            # A range from the start of the file is usable: only its head is read
+            self.assertEqual(web_seed.fetch_range(file, 0, 16384), data[:16384])
+            # Anything else would mean downloading the whole file to slice it
+            with self.assertRaises(IOError):
+                web_seed.fetch_range(file, 16384, 32768)
+        finally:
+            web_seed.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
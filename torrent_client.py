@@ -1,79 +1,221 @@
-import bencodepy
+# bencodepy and requests are imported where they are used, keeping startup fast
 import hashlib
 import struct
-import requests
+import sys
 import random
 import asyncio
 import time
-from urllib.parse import urlencode
+from urllib.parse import urlencode, quote
 import os
 import socket
+import mmap
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import json
+import ipaddress
 
-def test_raw_socket_connectivity():
-    """Test if we can make ANY outgoing connections"""
-    print("Testing raw socket connectivity...")
-    
-    test_targets = [
-        ('google.com', 80),
-        ('1.1.1.1', 53),  # Cloudflare DNS
-        ('8.8.8.8', 53),  # Google DNS
-        ('github.com', 443)
-    ]
-    
-    for target, port in test_targets:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5)
-            result = sock.connect_ex((target, port))
-            sock.close()
-            
-            if result == 0:
-                print(f"✅ Can reach {target}:{port}")
-            else:
-                print(f"❌ Cannot reach {target}:{port}")
-        except Exception as e:
-            print(f"⚠️  {target} test failed: {e}")
+# File priorities for selective download (0 = skip, never created on disk)
+FILE_PRIORITY_SKIP = 0
+FILE_PRIORITY_NORMAL = 1
+FILE_PRIORITY_HIGH = 2
 
-def test_alternative_connectivity():
-    """Test alternative connection methods"""
-    print("Testing alternative connectivity methods...")
-    
-    # Test common web ports that are rarely blocked
-    test_ports = [80, 443, 8080, 8443, 21, 22, 25, 53]
-    
-    for port in test_ports:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(3)
-            result = sock.connect_ex(('google.com', port))
-            sock.close()
-            
-            if result == 0:
-                print(f"✅ Port {port} (HTTP/HTTPS) is OPEN - Can use web proxies")
-            else:
-                print(f"❌ Port {port} is blocked")
-        except:
-            print(f"⚠️  Port {port} test failed")
+# Memory / pipeline limits
+DEFAULT_MEMORY_LIMIT = 64 * 1024 * 1024  # Session-wide budget for block buffers
+RECEIVE_BUFFER_LIMIT = 256 * 1024  # Per-connection StreamReader buffer
+MAX_MESSAGE_LENGTH = 2 * 1024 * 1024  # Anything larger is a broken/hostile peer
+MAX_REQUEST_DEPTH = 16  # Outstanding block requests per peer
+
+# Request timeouts / snubbing
+MIN_REQUEST_TIMEOUT = 2.0  # Seconds, lower bound for the RTT based request timeout
+MAX_REQUEST_TIMEOUT = 20.0  # Also used before the first RTT sample
+REQUEST_TIMEOUT_RTT_FACTOR = 4  # Timeout = factor * smoothed block RTT
+SNUB_TIMEOUT = 30  # No data for this long while requests are outstanding -> snubbed
+KEEPALIVE_INTERVAL = 60  # Send a keep-alive when nothing was sent for this long
+PEER_IDLE_TIMEOUT = 180  # Peers send keep-alives every ~2 minutes
+MESSAGE_TIMEOUT = 30  # A started message must arrive completely within this long
+
+# HTTP web seeds (BEP 19)
+WEB_SEED_MAX_IN_FLIGHT = 4  # Range requests in flight (= pooled keep-alive connections) per server
+WEB_SEED_MAX_FAILURES = 5  # Consecutive failures before a web seed is dropped
+WEB_SEED_P2P_FAST_RATE = 1024 * 1024  # Bytes/s from peers above which web seeds back off to one request
+WEB_SEED_READ_SIZE = 64 * 1024  # Chunk size when reading a body that ignored the Range header
+
+# Dual-stack peers (BEP 7): IPv4 + IPv6
+LISTEN_PORT = 6881  # Announced to trackers, incoming peers are accepted on both families
+CONNECT_TIMEOUT = 10.0  # Seconds per connection attempt
+HAPPY_EYEBALLS_DELAY = 0.25  # Head start of the preferred family before the next address is dialed
+CONNECT_FAILURE_PENALTY = CONNECT_TIMEOUT  # Counted as the connect time of a failed attempt
+IPV6_PROBE_ADDRESS = '2001:4860:4860::8888'  # Only used to pick the outgoing IPv6 address, nothing is sent
+
+# Local Service Discovery (BEP 14): multicast announces to find peers on the LAN
+LSD_PORT = 6771
+LSD_GROUP_IPV4 = '239.192.152.143'
+LSD_GROUP_IPV6 = 'ff15::efc0:988f'
+LSD_INTERFACE = '0.0.0.0'  # IPv4 interface address to announce on ('127.0.0.1' for loopback tests)
+LSD_ANNOUNCE_INTERVAL = 300  # Seconds between regular re-announces
+LSD_MIN_ANNOUNCE_INTERVAL = 5  # Answers to new LAN peers are at most this frequent (one answer reaches every newcomer)
+LSD_DISCOVERY_WAIT = 1.0  # Seconds a LAN answer may take when every other connection attempt failed
+
+def family_of(ip):
+    return 'ipv6' if ':' in ip else 'ipv4'
+
+def interleave_by_family(peers, first_family):
+    """Alternate IPv4/IPv6 (ip, port) entries, starting with `first_family` (RFC 8305)"""
+    first = [peer for peer in peers if family_of(peer[0]) == first_family]
+    second = [peer for peer in peers if family_of(peer[0]) != first_family]
+    result = []
+    for i in range(max(len(first), len(second))):
+        result.extend(first[i:i + 1] + second[i:i + 1])
+    return result
+
+def get_public_ipv6():
+    """Our global IPv6 address for the `ipv6=` announce parameter, or None"""
+    try:
+        with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+            sock.connect((IPV6_PROBE_ADDRESS, 80))
+            address = sock.getsockname()[0]
+        return address if ipaddress.ip_address(address).is_global else None
+    except (OSError, ValueError):
+        return None
+
+# Torrent creation: automatic piece size, parallel SHA-1 over memory-mapped files
+TARGET_PIECE_COUNT = 2000  # Automatic piece length aims for about this many pieces
+MIN_PIECE_LENGTH = 16 * 1024
+MAX_PIECE_LENGTH = 16 * 1024 * 1024
+HASH_JOB_SIZE = 64 * 1024 * 1024  # Bytes per hashing job (and progress callback granularity)
+HASH_READ_SIZE = 4 * 1024 * 1024  # Read size for files that can't be memory-mapped
+
+def choose_piece_length(total_size):
+    """Power of two between MIN_PIECE_LENGTH and MAX_PIECE_LENGTH giving ~TARGET_PIECE_COUNT pieces"""
+    piece_length = next_power_of_two(max(1, total_size // TARGET_PIECE_COUNT))
+    return min(MAX_PIECE_LENGTH, max(MIN_PIECE_LENGTH, piece_length))
+
+# BitTorrent v2 (BEP 52) Merkle trees: SHA-256 over 16 KiB blocks
+MERKLE_BLOCK_SIZE = 16384
+ZERO_HASH = bytes(32)
+MAX_HASHES_PER_REQUEST = 512
 
-def test_outgoing_connection():
-    """Test if we can make outgoing BitTorrent connections"""
-    test_ports = [6881, 6889, 51413]
+def next_power_of_two(n):
+    return 1 << max(0, n - 1).bit_length()
+
+def zero_subtree_hash(levels):
+    """Root of a tree of 2**levels zero leaves (padding beyond the end of a file)"""
+    node = ZERO_HASH
+    for _ in range(levels):
+        node = hashlib.sha256(node + node).digest()
+    return node
+
+def merkle_root(hashes, width, pad=ZERO_HASH):
+    """Root of a SHA-256 Merkle tree over `hashes`, padded to `width` leaves with `pad`"""
+    layer = list(hashes)
+    while width > 1:
+        if len(layer) % 2:
+            layer.append(pad)
+        layer = [hashlib.sha256(layer[i] + layer[i + 1]).digest() for i in range(0, len(layer), 2)]
+        pad = hashlib.sha256(pad + pad).digest()
+        width //= 2
+    return layer[0] if layer else pad
+
+def merkle_verify_proof(node, position, proof, root):
+    """Walk uncle hashes (bottom-up) from a subtree root at `position` to the file root"""
+    for uncle in proof:
+        if position % 2 == 0:
+            node = hashlib.sha256(node + uncle).digest()
+        else:
+            node = hashlib.sha256(uncle + node).digest()
+        position //= 2
+    return node == root
+
+# Network diagnostics (optional: `--diagnose`), probed concurrently and cached on disk
+DIAGNOSTIC_TARGETS = [
+    # (group, host, port)
+    ('bittorrent', 'google.com', 6881),
+    ('bittorrent', 'google.com', 6889),
+    ('bittorrent', 'google.com', 51413),
+    ('web', 'google.com', 80),
+    ('web', 'google.com', 443),
+    ('web', 'google.com', 8080),
+    ('web', 'google.com', 8443),
+    ('web', 'google.com', 21),
+    ('web', 'google.com', 22),
+    ('web', 'google.com', 25),
+    ('web', 'google.com', 53),
+    ('raw', 'google.com', 80),
+    ('raw', '1.1.1.1', 53),  # Cloudflare DNS
+    ('raw', '8.8.8.8', 53),  # Google DNS
+    ('raw', 'github.com', 443),
+]
+DIAGNOSTICS_TIMEOUT = 3.0  # Per connection attempt
+DIAGNOSTICS_DEADLINE = 5.0  # For the whole probe
+DIAGNOSTICS_CACHE_TTL = 3600  # Seconds before the cached results are probed again
+
+async def probe_target(host, port, timeout):
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+        writer.close()
+        return 'open'
+    except asyncio.TimeoutError:
+        return 'timeout'
+    except OSError:
+        return 'blocked'
+
+async def probe_connectivity(targets=DIAGNOSTIC_TARGETS, timeout=DIAGNOSTICS_TIMEOUT,
+                             deadline=DIAGNOSTICS_DEADLINE):
+    """Try every (host, port) at once; anything unfinished at the deadline counts as a timeout"""
+    unique = sorted({(host, port) for _, host, port in targets})
+    tasks = {target: asyncio.create_task(probe_target(*target, timeout)) for target in unique}
+    done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+    for task in pending:
+        task.cancel()
+    return {f'{host}:{port}': task.result() if task in done else 'timeout'
+            for (host, port), task in tasks.items()}
+
+def get_diagnostics_cache_path():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'python-torrent-client', 'diagnostics.json')
+
+def load_cached_diagnostics(ttl=DIAGNOSTICS_CACHE_TTL):
+    try:
+        with open(get_diagnostics_cache_path()) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - cached.get('timestamp', 0) > ttl:
+        return None
+    return cached
+
+def save_diagnostics(results):
+    path = get_diagnostics_cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'timestamp': time.time(), 'results': results}, f)
+    except OSError as e:
+        print(f"⚠️  Could not cache diagnostics: {e}")
+
+def run_network_diagnostics(use_cache=True):
+    """Test outgoing BitTorrent ports, web ports and raw connectivity"""
+    cached = load_cached_diagnostics() if use_cache else None
+    if cached:
+        results = cached['results']
+        print(f"Network diagnostics (cached {(time.time() - cached['timestamp']) / 60:.0f} min ago, --no-cache to re-run):")
+    else:
+        print("Running network diagnostics...")
+        results = asyncio.run(probe_connectivity())
+        save_diagnostics(results)
     
-    for port in test_ports:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5)
-            # Try to connect to a known working service
-            result = sock.connect_ex(('google.com', port))
-            sock.close()
-            
-            if result == 0:
-                print(f"✅ Outgoing port {port} is OPEN")
-            else:
-                print(f"❌ Outgoing port {port} is BLOCKED")
-                
-        except Exception as e:
-            print(f"⚠️  Port {port} test failed: {e}")
+    for group, host, port in DIAGNOSTIC_TARGETS:
+        is_open = results.get(f'{host}:{port}') == 'open'
+        if group == 'bittorrent':
+            print(f"✅ Outgoing port {port} is OPEN" if is_open else f"❌ Outgoing port {port} is BLOCKED")
+        elif group == 'web':
+            print(f"✅ Port {port} (HTTP/HTTPS) is OPEN - Can use web proxies" if is_open
+                  else f"❌ Port {port} is blocked")
+        else:
+            print(f"✅ Can reach {host}:{port}" if is_open else f"❌ Cannot reach {host}:{port}")
+    return results
 
 # This class is added to track the progress of the file we are downloading Using a torrent 
 class ProgressTracker:
@@ -89,7 +231,7 @@ class ProgressTracker:
         self.downloaded_pieces += 1
         
     def get_progress(self):
-        percent = (self.downloaded_size / self.total_size) * 100
+        percent = (self.downloaded_size / self.total_size) * 100 if self.total_size > 0 else 100.0
         elapsed = time.time() - self.start_time
         speed = self.downloaded_size / elapsed if elapsed > 0 else 0
         
@@ -102,32 +244,364 @@ class ProgressTracker:
             'total_pieces': self.total_pieces
         }
 
+# This class is added to keep block buffers (socket -> verification -> disk) inside a fixed memory budget
+class MemoryBudget:
+    CATEGORIES = ('receive', 'piece', 'cache')
+
+    def __init__(self, limit_bytes=DEFAULT_MEMORY_LIMIT):
+        self.limit = limit_bytes
+        self.usage = {category: 0 for category in self.CATEGORIES}
+        self.peak = 0
+        self.pauses = 0  # How often socket reads had to wait for room
+        self.room_event = None  # Created lazily inside the running event loop
+    
+    def used(self):
+        return sum(self.usage.values())
+    
+    def is_exhausted(self):
+        return self.used() >= self.limit
+    
+    def reserve(self, category, size):
+        """Account for a buffer; never fails, callers apply backpressure via wait_for_room"""
+        self.usage[category] += size
+        self.peak = max(self.peak, self.used())
+    
+    def release(self, category, size):
+        self.usage[category] = max(0, self.usage[category] - size)
+        if self.room_event and not self.is_exhausted():
+            self.room_event.set()
+    
+    async def wait_for_room(self):
+        """Block the caller (a socket reader) until the budget has room again"""
+        if not self.is_exhausted():
+            return
+        if self.room_event is None:
+            self.room_event = asyncio.Event()
+        self.pauses += 1
+        while self.is_exhausted():
+            self.room_event.clear()
+            await self.room_event.wait()
+    
+    def request_depth(self, max_depth):
+        """Shrink the per-peer request pipeline once more than half the budget is in use"""
+        free = self.limit - self.used()
+        if free >= self.limit / 2:
+            return max_depth
+        return max(1, int(max_depth * free * 2 / self.limit))
+    
+    def get_stats(self):
+        return {
+            'limit_mb': self.limit / 1024 / 1024,
+            'used_mb': self.used() / 1024 / 1024,
+            'peak_mb': self.peak / 1024 / 1024,
+            'receive_mb': self.usage['receive'] / 1024 / 1024,
+            'piece_mb': self.usage['piece'] / 1024 / 1024,
+            'cache_mb': self.usage['cache'] / 1024 / 1024,
+            'read_pauses': self.pauses
+        }
+
+# This class is added to keep peer statistics per address family and to prefer the faster one
+class PeerStats:
+    def __init__(self):
+        self.families = {
+            family: {'known': 0, 'attempted': 0, 'connected': 0, 'failed': 0, 'incoming': 0,
+                     'downloaded': 0, 'connect_time': None}
+            for family in ('ipv4', 'ipv6')
+        }
+
+    def add_known(self, peers):
+        for ip, port in peers:
+            self.families[family_of(ip)]['known'] += 1
+
+    def update_connect_time(self, family, elapsed):
+        stats = self.families[family]
+        if stats['connect_time'] is None:
+            stats['connect_time'] = elapsed
+        else:
+            stats['connect_time'] = 0.75 * stats['connect_time'] + 0.25 * elapsed
+
+    def record_attempt(self, family):
+        self.families[family]['attempted'] += 1
+
+    def record_connect(self, family, elapsed):
+        self.families[family]['connected'] += 1
+        self.update_connect_time(family, elapsed)
+
+    def record_failure(self, family):
+        self.families[family]['failed'] += 1
+        self.update_connect_time(family, CONNECT_FAILURE_PENALTY)
+
+    def record_race(self, outcomes):
+        """One race to one peer (ip -> ('connected' | 'lost' | 'failed', seconds)): one attempt per family dialed"""
+        won = any(result == 'connected' for result, elapsed in outcomes.values())
+        by_family = {}
+        for ip, (result, elapsed) in outcomes.items():
+            by_family.setdefault(family_of(ip), []).append((result, elapsed))
+        for family, results in by_family.items():
+            self.record_attempt(family)
+            connected = [elapsed for result, elapsed in results if result == 'connected']
+            lost = [elapsed for result, elapsed in results if result == 'lost']
+            if connected:
+                self.record_connect(family, connected[0])
+            elif lost and won:
+                # Lost the race: it would have taken at least this long
+                self.update_connect_time(family, max(lost))
+            else:
+                self.record_failure(family)
+
+    def record_incoming(self, family):
+        self.families[family]['incoming'] += 1
+
+    def record_download(self, family, length):
+        self.families[family]['downloaded'] += length
+
+    def preferred_family(self):
+        """The family with the lower smoothed connect time (IPv6 until we know better)"""
+        measured = {family: stats['connect_time'] for family, stats in self.families.items()
+                    if stats['connect_time'] is not None}
+        if not measured:
+            return 'ipv6'
+        return min(measured, key=measured.get)
+
+    def get_stats(self):
+        return {family: dict(stats, downloaded_mb=stats['downloaded'] / 1024 / 1024)
+                for family, stats in self.families.items()}
+
 # This class is added To do the file writing in the downloaded folder properly
 class FileWriter:
-    def __init__(self, torrent_parser, download_path='./downloads', client=None):
+    def __init__(self, torrent_parser, download_path='./downloads', client=None, piece_manager=None,
+                 memory_budget=None):
         self.parser = torrent_parser
         self.download_path = download_path
-        self.file_handle = None
         self.client = client  # Add client reference for progress tracking
+        self.piece_manager = piece_manager
+        self.memory_budget = memory_budget
+        # Write-back cache: blocks are written by a single disk thread so the
+        # event loop never waits on the disk. Queued bytes count against the budget.
+        self.executor = None
+        self.files = []
+        self.file_offsets = []
+        self.file_handles = {}  # file index -> open handle (only wanted files)
+        # Blocks that belong to skipped files go to a partfile so the skipped
+        # files never get created. Each piece gets its own slot in the partfile.
+        self.part_path = None
+        self.part_handle = None
+        self.part_slots = {}  # piece index -> slot in partfile
         
     def initialize_file(self):
         os.makedirs(self.download_path, exist_ok=True)
         info = self.parser.metadata[b'info']
         filename = info[b'name'].decode('utf-8')
         filepath = os.path.join(self.download_path, filename)
+        self.part_path = os.path.join(self.download_path, f'.{filename}.parts')
         
-        self.file_handle = open(filepath, 'wb')
-        self.file_handle.truncate(info[b'length'])
+        self.files = self.parser.get_files()
+        self.file_offsets = [f['offset'] for f in self.files]
+        for file_index in range(len(self.files)):
+            if self.is_file_wanted(file_index):
+                self.open_file(file_index)
         return filepath
     
+    def is_file_wanted(self, file_index):
+        if self.files and self.files[file_index]['pad']:
+            return False  # BEP 47 pad files only align pieces and are never written
+        if not self.piece_manager:
+            return True
+        return self.piece_manager.file_priorities[file_index] != FILE_PRIORITY_SKIP
+    
+    def open_file(self, file_index):
+        """Create (preallocate) a file of the torrent and keep its handle"""
+        if file_index not in self.file_handles:
+            file = self.files[file_index]
+            filepath = os.path.join(self.download_path, file['path'])
+            os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+            handle = open(filepath, 'w+b')  # Readable so pieces can be verified from disk
+            handle.truncate(file['length'])
+            self.file_handles[file_index] = handle
+        return self.file_handles[file_index]
+    
+    def get_piece_length(self):
+        return self.parser.metadata[b'info'][b'piece length']
+    
+    def skip_gap(self, file_index, pos, end):
+        """Position after a gap (v2 files start on piece boundaries), or None past the last file"""
+        if file_index + 1 < len(self.files):
+            return min(end, self.file_offsets[file_index + 1])
+        return None
+    
     def write_piece(self, piece_index, data, offset):
-        if self.file_handle:
-            self.file_handle.seek(offset)
-            self.file_handle.write(data)
+        """Write data at a torrent-wide offset, splitting it across files"""
+        if not self.files:
+            return
+        piece_length = self.get_piece_length()
+        view = memoryview(data)
+        pos = offset
+        end = offset + len(data)
+        
+        while pos < end:
+            file_index = bisect_right(self.file_offsets, pos) - 1
+            file = self.files[file_index]
+            segment_end = min(end, file['offset'] + file['length'])
+            if segment_end <= pos:
+                pos = self.skip_gap(file_index, pos, end)
+                if pos is None:
+                    break  # Data past the end of the torrent
+                continue
+            
+            if file['pad']:
+                pass  # Pad file bytes are always zero, nothing to store
+            # Files already on disk keep receiving their data even if skipped later
+            elif file_index in self.file_handles or self.is_file_wanted(file_index):
+                handle = self.open_file(file_index)
+                handle.seek(pos - file['offset'])
+                handle.write(view[pos - offset:segment_end - offset])
+            else:
+                # Never cross a piece boundary inside one partfile write
+                piece = pos // piece_length
+                segment_end = min(segment_end, (piece + 1) * piece_length)
+                part = self.get_part_handle()
+                slot = self.part_slots.setdefault(piece, len(self.part_slots))
+                part.seek(slot * piece_length + (pos - piece * piece_length))
+                part.write(view[pos - offset:segment_end - offset])
+            pos = segment_end
+    
+    def read_data(self, offset, length):
+        """Read torrent-wide data back from the files/partfile; gaps and pad files read as zeros"""
+        data = bytearray(length)
+        if not self.files:
+            return bytes(data)
+        piece_length = self.get_piece_length()
+        pos = offset
+        end = offset + length
+        
+        while pos < end:
+            file_index = bisect_right(self.file_offsets, pos) - 1
+            file = self.files[file_index]
+            segment_end = min(end, file['offset'] + file['length'])
+            if segment_end <= pos:
+                pos = self.skip_gap(file_index, pos, end)
+                if pos is None:
+                    break
+                continue
+            
+            chunk = b''
+            if file['pad']:
+                pass
+            elif file_index in self.file_handles:
+                handle = self.file_handles[file_index]
+                handle.seek(pos - file['offset'])
+                chunk = handle.read(segment_end - pos)
+            else:
+                piece = pos // piece_length
+                segment_end = min(segment_end, (piece + 1) * piece_length)
+                slot = self.part_slots.get(piece)
+                if slot is not None:
+                    self.part_handle.seek(slot * piece_length + (pos - piece * piece_length))
+                    chunk = self.part_handle.read(segment_end - pos)
+            data[pos - offset:pos - offset + len(chunk)] = chunk
+            pos = segment_end
+        return bytes(data)
+    
+    def get_executor(self):
+        if self.executor is None:
+            # One worker keeps seek+write pairs on shared handles serialized
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='disk-writer')
+        return self.executor
+    
+    def verify_piece(self, piece_manager, piece_index):
+        """Read a piece back and hash it on the disk thread (after its queued writes)"""
+        size = piece_manager.pieces[piece_index]['size']
+        if self.memory_budget:
+            self.memory_budget.reserve('piece', size)  # The whole piece is held in memory while hashing
+        
+        def job():
+            data = self.read_data(piece_index * self.get_piece_length(), size)
+            return piece_manager.check_piece(piece_index, data)
+        
+        def on_verified(future):
+            if self.memory_budget:
+                self.memory_budget.release('piece', size)
+        
+        future = asyncio.get_running_loop().run_in_executor(self.get_executor(), job)
+        future.add_done_callback(on_verified)
+        return future
+    
+    def queue_write(self, piece_index, data, offset):
+        """Hand a block to the disk thread (write-back); returns immediately"""
+        size = len(data)
+        if self.memory_budget:
+            self.memory_budget.reserve('cache', size)
+        
+        def on_written(future):
+            if self.memory_budget:
+                self.memory_budget.release('cache', size)
+            if future.exception():
+                print(f"✗ File write error: {future.exception()}")
+        
+        future = asyncio.get_running_loop().run_in_executor(
+            self.get_executor(), self.write_piece, piece_index, data, offset)
+        future.add_done_callback(on_written)
+        return future
+    
+    def flush(self):
+        """Wait until every queued block reached the disk"""
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+    
+    def get_part_handle(self):
+        if not self.part_handle:
+            self.part_handle = open(self.part_path, 'w+b')
+        return self.part_handle
+    
+    def apply_priorities(self):
+        """Create files that became wanted and move their data out of the partfile"""
+        if not self.files:
+            return
+        piece_length = self.get_piece_length()
+        for file_index, file in enumerate(self.files):
+            if file_index in self.file_handles or not self.is_file_wanted(file_index):
+                continue
+            handle = self.open_file(file_index)
+            if not self.part_handle or file['length'] == 0:
+                continue
+            
+            file_start = file['offset']
+            file_end = file_start + file['length']
+            for piece in range(file_start // piece_length, (file_end - 1) // piece_length + 1):
+                slot = self.part_slots.get(piece)
+                if slot is None:
+                    continue
+                start = max(file_start, piece * piece_length)
+                end = min(file_end, (piece + 1) * piece_length)
+                self.part_handle.seek(slot * piece_length + (start - piece * piece_length))
+                chunk = self.part_handle.read(end - start)
+                handle.seek(start - file_start)
+                handle.write(chunk)
+            print(f"📂 File enabled: {file['path']}")
+    
+    def queue_priorities(self):
+        """Run apply_priorities on the disk thread, serialized with the queued writes to the same handles"""
+        def on_applied(future):
+            if future.exception():
+                print(f"✗ Error applying file priorities: {future.exception()}")
+        
+        future = self.get_executor().submit(self.apply_priorities)
+        future.add_done_callback(on_applied)
+        return future
     
     def close(self):
-        if self.file_handle:
-            self.file_handle.close()
+        self.flush()
+        for handle in self.file_handles.values():
+            handle.close()
+        self.file_handles = {}
+        if self.part_handle:
+            self.part_handle.close()
+            self.part_handle = None
+        # The slot index lives in memory only (and a reopen truncates), so a kept partfile could never be read back
+        if self.part_path and os.path.exists(self.part_path):
+            os.remove(self.part_path)
+        self.part_slots = {}
 
 # This class is added for peace management in Actual file downloading portion 
 class PieceManager:
@@ -135,62 +609,304 @@ class PieceManager:
         self.parser = torrent_parser
         self.pieces = []
         self.downloaded_pieces = set()  # Track which pieces are fully downloaded
-        self.piece_blocks = {}  # Track blocks received for each piece
+        self.piece_blocks = {}  # Track blocks received for each piece (created on first block)
+        self.piece_length = torrent_parser.metadata[b'info'][b'piece length']
+        self.files = torrent_parser.get_files()
+        self.file_priorities = [FILE_PRIORITY_SKIP if f['pad'] else FILE_PRIORITY_NORMAL for f in self.files]
+        self.piece_priorities = []
+        self.in_progress = set()  # Pieces some peer is currently fetching
+        self.orphan_blocks = deque()  # (piece, begin, length) given up by slow/snubbed peers
+        # BitTorrent v2 state
+        self.is_v2 = torrent_parser.is_v2()
+        self.root_pieces = {}  # pieces root -> first piece of that file
+        self.missing_layers = {}  # pieces root -> piece count, for files without a usable piece layer
+        self.hash_requests = set()  # (root, base layer, index) currently asked from some peer
+        self.awaiting_hashes = set()  # Complete pieces that wait for their piece layer
         self.initialize_pieces()
     
     def initialize_pieces(self):
-        info = self.parser.metadata[b'info']
-        piece_length = info[b'piece length']
-        total_size = info[b'length']
+        piece_length = self.piece_length
+        total_size = self.parser.get_piece_space_size()
         piece_hashes = self.parser.get_piece_hashes()
+        v2_pieces = self.parser.get_v2_piece_info() if self.is_v2 else {}
+        pure_v2 = self.is_v2 and not self.parser.is_hybrid()
         
         self.pieces = []
         for i in range(len(piece_hashes)):
             start = i * piece_length
             end = min(start + piece_length, total_size)
             size = end - start
+            v2 = v2_pieces.get(i)
+            if v2:
+                self.root_pieces.setdefault(v2['root'], i)
+                if v2['hash_v2'] is None:
+                    self.missing_layers[v2['root']] = v2['piece_count']
+                if pure_v2:
+                    size = v2['data_length']  # No padding on the wire in v2-only swarms
             
             self.pieces.append({
                 'index': i,
                 'hash': piece_hashes[i],
+                'v2': v2,
                 'size': size,
                 'downloaded': False,
                 'data': None
             })
-            
-            # Initialize block tracking for this piece
-            self.piece_blocks[i] = set()
+        
+        self.update_piece_priorities()
+    
+    def set_file_priority(self, file_index, priority):
+        """Change a file's priority; takes effect for the next piece requests"""
+        if not 0 <= file_index < len(self.files):
+            print(f"✗ Invalid file index: {file_index}")
+            return False
+        if priority not in (FILE_PRIORITY_SKIP, FILE_PRIORITY_NORMAL, FILE_PRIORITY_HIGH):
+            print(f"✗ Invalid file priority: {priority}")
+            return False
+        self.file_priorities[file_index] = priority
+        self.update_piece_priorities()
+        return True
+    
+    def update_piece_priorities(self):
+        """A piece gets the highest priority of the files it overlaps"""
+        priorities = [FILE_PRIORITY_SKIP] * len(self.pieces)
+        for file, priority in zip(self.files, self.file_priorities):
+            if priority == FILE_PRIORITY_SKIP or file['length'] == 0:
+                continue
+            first = file['offset'] // self.piece_length
+            last = min((file['offset'] + file['length'] - 1) // self.piece_length, len(self.pieces) - 1)
+            for i in range(first, last + 1):
+                if priorities[i] < priority:
+                    priorities[i] = priority
+        self.piece_priorities = priorities
+        self.priority_levels = set(priorities)  # Lets pick_pieces skip levels no piece has
+        # Kept up to date by claim_piece/mark_piece_verified so "nothing left" checks are O(1)
+        self.wanted_left = sum(1 for i in range(len(self.pieces))
+                               if priorities[i] != FILE_PRIORITY_SKIP and not self.pieces[i]['downloaded'])
+        self.unclaimed_left = self.wanted_left - sum(1 for i in self.in_progress
+                                                     if self.is_piece_wanted(i) and not self.pieces[i]['downloaded'])
+    
+    def is_piece_wanted(self, piece_index):
+        return self.piece_priorities[piece_index] != FILE_PRIORITY_SKIP
+    
+    def is_piece_unclaimed(self, piece_index):
+        return (self.is_piece_wanted(piece_index) and not self.pieces[piece_index]['downloaded']
+                and piece_index not in self.in_progress)
+    
+    def pick_pieces(self, count=1, start=0, exclude=()):
+        """Return up to `count` wanted pieces not yet downloaded, highest priority first"""
+        picked = []
+        if not self.unclaimed_left:
+            return picked  # Everything left is being fetched already: skip the scan
+        total = len(self.pieces)
+        for priority in (FILE_PRIORITY_HIGH, FILE_PRIORITY_NORMAL):
+            if priority not in self.priority_levels:
+                continue
+            for n in range(total):
+                i = (start + n) % total
+                if (self.piece_priorities[i] == priority and not self.pieces[i]['downloaded']
+                        and i not in exclude and i not in self.in_progress):
+                    picked.append(i)
+                    if len(picked) >= count:
+                        return picked
+        return picked
+    
+    def all_wanted_downloaded(self):
+        return self.wanted_left == 0
+    
+    def get_wanted_size(self):
+        return sum(file['length'] for file, priority in zip(self.files, self.file_priorities)
+                   if priority != FILE_PRIORITY_SKIP)
+    
+    def claim_piece(self, piece_index):
+        """Keep other peers from picking a piece that is already being fetched"""
+        if self.is_piece_unclaimed(piece_index):
+            self.unclaimed_left -= 1
+        self.in_progress.add(piece_index)
+    
+    def is_block_received(self, piece_index, block_offset, block_size):
+        return (block_offset, block_offset + block_size) in self.piece_blocks.get(piece_index, ())
+    
+    def return_blocks(self, blocks):
+        """Put blocks from a timed-out/snubbed/gone peer up for reassignment"""
+        for piece_index, begin, length in blocks:
+            if not self.is_block_received(piece_index, begin, length):
+                self.orphan_blocks.append((piece_index, begin, length))
+    
+    def take_orphan_block(self, accept=None):
+        """Hand out a reassigned block, optionally only one the `accept` callback allows"""
+        for _ in range(len(self.orphan_blocks)):
+            block = self.orphan_blocks.popleft()
+            piece_index, begin, length = block
+            if self.pieces[piece_index]['downloaded'] or self.is_block_received(piece_index, begin, length):
+                continue  # Arrived late from the original peer
+            if accept and not accept(block):
+                self.orphan_blocks.append(block)
+                continue
+            return block
+        return None
     
     def mark_block_received(self, piece_index, block_offset, block_size):
-        """Mark a block as received for a piece"""
+        """Mark a block as received; True once all blocks are in and the piece needs verifying"""
         if piece_index not in self.piece_blocks:
             self.piece_blocks[piece_index] = set()
+        if piece_index in self.downloaded_pieces or self.is_piece_complete(piece_index):
+            return False  # Duplicate of a reassigned block
         
         # Store the block range that we've received
         block_range = (block_offset, block_offset + block_size)
         self.piece_blocks[piece_index].add(block_range)
         
         # Check if piece is complete (all blocks received)
-        if self.is_piece_complete(piece_index):
-            self.pieces[piece_index]['downloaded'] = True
-            self.downloaded_pieces.add(piece_index)
-            return True
-        return False
+        return self.is_piece_complete(piece_index)
+    
+    def mark_piece_verified(self, piece_index):
+        if self.is_piece_unclaimed(piece_index):
+            self.unclaimed_left -= 1
+        if self.is_piece_wanted(piece_index) and not self.pieces[piece_index]['downloaded']:
+            self.wanted_left -= 1
+        self.pieces[piece_index]['downloaded'] = True
+        self.downloaded_pieces.add(piece_index)
+        self.in_progress.discard(piece_index)
+        self.awaiting_hashes.discard(piece_index)
+    
+    def mark_blocks_bad(self, piece_index, block_numbers):
+        """Forget corrupt blocks and queue just those for another download"""
+        size = self.pieces[piece_index]['size']
+        blocks = []
+        for n in block_numbers:
+            begin = n * MERKLE_BLOCK_SIZE
+            length = min(MERKLE_BLOCK_SIZE, size - begin)
+            self.piece_blocks.get(piece_index, set()).discard((begin, begin + length))
+            blocks.append((piece_index, begin, length))
+        self.return_blocks(blocks)
+        return blocks
+    
+    def refetch_piece(self, piece_index):
+        """Fetch a whole piece again when its bad blocks can't be pinpointed"""
+        piece = self.pieces[piece_index]
+        if piece.get('v2'):
+            piece['v2']['data_block_hashes'] = None
+        return self.mark_blocks_bad(piece_index, range(-(-piece['size'] // MERKLE_BLOCK_SIZE)))
+    
+    def check_piece(self, piece_index, data):
+        """Hash a complete piece (runs on the disk thread, off the event loop)
+        
+        v2 pieces are checked block by block once the leaf hashes are known, otherwise
+        against their Merkle piece hash; v1 pieces against their SHA-1.
+        Returns {'ok': True/False/None, 'bad_blocks': [...] or None, 'block_hashes': [...]}
+        """
+        piece = self.pieces[piece_index]
+        v2 = piece['v2']
+        if v2 and (v2['hash_v2'] or v2['block_hashes']):
+            # Hybrid pieces may end in pad bytes, which are not part of the file's tree
+            data_length = v2['data_length']
+            block_hashes = [hashlib.sha256(data[offset:min(offset + MERKLE_BLOCK_SIZE, data_length)]).digest()
+                            for offset in range(0, data_length, MERKLE_BLOCK_SIZE)]
+            if v2['block_hashes']:
+                bad = [n for n, block_hash in enumerate(block_hashes) if block_hash != v2['block_hashes'][n]]
+                return {'ok': not bad, 'bad_blocks': bad, 'block_hashes': block_hashes}
+            ok = merkle_root(block_hashes, v2['width']) == v2['hash_v2']
+            return {'ok': ok, 'bad_blocks': None, 'block_hashes': block_hashes}
+        if piece['hash']:
+            ok = hashlib.sha1(data).digest() == piece['hash']
+            # v1 can't tell which block was bad - the whole piece is fetched again
+            all_blocks = list(range(-(-piece['size'] // MERKLE_BLOCK_SIZE)))
+            return {'ok': ok, 'bad_blocks': [] if ok else all_blocks, 'block_hashes': None}
+        return {'ok': None, 'bad_blocks': None, 'block_hashes': None}  # Piece layer not known yet
+    
+    def apply_verification(self, piece_index, result):
+        """Act on a check_piece result: 'verified', 'bad_blocks', 'need_hashes' or 'waiting'"""
+        if result['ok']:
+            self.mark_piece_verified(piece_index)
+            return 'verified'
+        if result['ok'] is None:
+            self.awaiting_hashes.add(piece_index)
+            return 'waiting'
+        if result['bad_blocks'] is None:
+            # Merkle root mismatch: fetch the leaf hashes to pinpoint the bad blocks
+            self.pieces[piece_index]['v2']['data_block_hashes'] = result['block_hashes']
+            return 'need_hashes'
+        self.mark_blocks_bad(piece_index, result['bad_blocks'])
+        return 'bad_blocks'
+    
+    def get_block_hash_request(self, piece_index):
+        """Hash request (root, base layer, index, length, proof layers) for a piece's leaf hashes"""
+        v2 = self.pieces[piece_index]['v2']
+        return (v2['root'], 0, v2['piece_in_file'] * v2['width'], v2['width'], 0)
+    
+    def get_layer_hash_requests(self):
+        """Hash requests for piece layers missing from the torrent file, in chunks of 512"""
+        base_layer = (self.piece_length // MERKLE_BLOCK_SIZE).bit_length() - 1
+        requests_to_send = []
+        for root, count in self.missing_layers.items():
+            width = next_power_of_two(count)
+            chunk = min(width, MAX_HASHES_PER_REQUEST)
+            proof_layers = (width // chunk).bit_length() - 1
+            for index in range(0, count, chunk):
+                if (root, base_layer, index) not in self.hash_requests:
+                    requests_to_send.append((root, base_layer, index, chunk, proof_layers))
+        return requests_to_send
+    
+    def handle_hashes(self, root, base_layer, index, length, hashes, proof):
+        """Validate a `hashes` message; returns the pieces that can now be (re)verified"""
+        self.hash_requests.discard((root, base_layer, index))
+        first = self.root_pieces.get(root)
+        if first is None or length == 0:
+            return []
+        v2_first = self.pieces[first]['v2']
+        
+        if base_layer == 0:
+            # Leaf hashes for one piece, trusted once they hash up to the known piece hash
+            piece_index = first + index // v2_first['width']
+            v2 = self.pieces[piece_index]['v2'] if piece_index < len(self.pieces) else None
+            if not v2 or v2['root'] != root or merkle_root(hashes, v2['width']) != v2['hash_v2']:
+                print("✗ Received leaf hashes that do not match the piece hash")
+                return []
+            v2['block_hashes'] = hashes
+            data_hashes = v2['data_block_hashes']
+            v2['data_block_hashes'] = None
+            if data_hashes:
+                bad = [n for n, block_hash in enumerate(data_hashes) if block_hash != hashes[n]]
+                self.mark_blocks_bad(piece_index, bad or range(len(data_hashes)))
+                print(f"🔍 Piece {piece_index}: {len(bad)} bad block(s) pinpointed - refetching only those")
+            return []
+        
+        # Piece layer hashes, checked against the file's pieces root with the uncle hashes
+        pad = zero_subtree_hash(base_layer)
+        subtree_root = merkle_root(hashes, length, pad)
+        if not merkle_verify_proof(subtree_root, index // length, proof, root):
+            print("✗ Received piece layer hashes that do not match the pieces root")
+            return []
+        count = v2_first['piece_count']
+        for n in range(index, min(index + length, count)):
+            self.pieces[first + n]['v2']['hash_v2'] = hashes[n - index]
+        if all(self.pieces[first + n]['v2']['hash_v2'] for n in range(count)):
+            self.missing_layers.pop(root, None)
+            print(f"🌳 Piece layer complete for file {v2_first['file_index']}")
+        ready = [i for i in self.awaiting_hashes if self.pieces[i]['v2']['hash_v2']]
+        for i in ready:
+            self.awaiting_hashes.discard(i)
+        return ready
     
     def is_piece_complete(self, piece_index):
         """Check if all blocks of a piece have been received"""
-        # This is a simplified check - real implementation would verify all blocks
-        return len(self.piece_blocks.get(piece_index, set())) > 0
+        # Blocks are requested on 16 KiB boundaries, so the ranges never overlap
+        received = sum(end - start for start, end in self.piece_blocks.get(piece_index, ()))
+        return received >= self.pieces[piece_index]['size']
 
 class TorrentParser:
     def __init__(self, torrent_file):
         self.torrent_file = torrent_file
         self.metadata = None
+        self.info_hash = None  # Cached, the info dict is re-encoded to compute it
         
     def parse(self):
         try:
+            import bencodepy
             with open(self.torrent_file, 'rb') as f:
                 self.metadata = bencodepy.decode(f.read())
+            self.info_hash = None
             print("✓ Torrent file parsed successfully")
             print(f"  Torrent name: {self.metadata[b'info'].get(b'name', b'Unknown').decode('utf-8', errors='ignore')}")
             return self.metadata
@@ -199,40 +915,341 @@ class TorrentParser:
             return None
     
     def get_info_hash(self):
-        info = self.metadata[b'info']
-        return hashlib.sha1(bencodepy.encode(info)).digest()
+        if self.info_hash is None:
+            import bencodepy
+            info = self.metadata[b'info']
+            if self.is_v2() and not self.is_hybrid():
+                # Pure v2 swarms use the SHA-256 info hash truncated to 20 bytes on the wire
+                self.info_hash = self.get_info_hash_v2()[:20]
+            else:
+                self.info_hash = hashlib.sha1(bencodepy.encode(info)).digest()
+        return self.info_hash
+    
+    def get_info_hash_v2(self):
+        import bencodepy
+        return hashlib.sha256(bencodepy.encode(self.metadata[b'info'])).digest()
+    
+    def is_v2(self):
+        """BEP 52 torrent (pure v2 or hybrid)"""
+        return self.metadata[b'info'].get(b'meta version') == 2 and b'file tree' in self.metadata[b'info']
+    
+    def is_hybrid(self):
+        """v2 torrent that also carries the v1 `pieces` list (and pad files)"""
+        return self.is_v2() and b'pieces' in self.metadata[b'info']
     
     def get_announce_url(self):
         return self.metadata[b'announce'].decode('utf-8')
     
+    def get_url_list(self):
+        """HTTP web seed URLs (BEP 19 `url-list`, a single string or a list)"""
+        url_list = self.metadata.get(b'url-list', [])
+        if isinstance(url_list, bytes):
+            url_list = [url_list]
+        return [url.decode('utf-8', errors='ignore') for url in url_list if url]
+    
     def get_piece_hashes(self):
         info = self.metadata[b'info']
+        if b'pieces' not in info:
+            # Pure v2: one entry per piece, verified through the Merkle trees instead
+            return [None] * (-(-self.get_piece_space_size() // info[b'piece length']))
         pieces = info[b'pieces']
-        piece_hashes = []
-        for i in range(0, len(pieces), 20):
-            piece_hashes.append(pieces[i:i+20])
-        return piece_hashes
+        return [pieces[i:i+20] for i in range(0, len(pieces), 20)]
     
     def get_file_size(self):
         info = self.metadata[b'info']
         if b'length' in info:
             return info[b'length']  # Single file
-        else:
+        elif b'files' in info:
             # Multiple files
             total_size = 0
             for file in info[b'files']:
                 total_size += file[b'length']
             return total_size
+        else:
+            # v2 only
+            return sum(file['length'] for file in self.get_files())
+    
+    def get_piece_space_size(self):
+        """Size of the byte stream pieces are cut from (v2 files start on piece boundaries)"""
+        if self.is_v2() and not self.is_hybrid():
+            files = self.get_files()
+            return max((file['offset'] + file['length'] for file in files), default=0)
+        return self.get_file_size()
+
+    def get_files(self):
+        """List the torrent's files with their byte offset in the piece stream"""
+        info = self.metadata[b'info']
+        name = info[b'name'].decode('utf-8', errors='ignore')
+        tree_files = self.get_file_tree() if self.is_v2() else {}
+        if b'length' in info:
+            root = tree_files.get((name,), {}).get(b'pieces root')
+            return [{'path': name, 'length': info[b'length'], 'offset': 0, 'pad': False, 'pieces_root': root}]
+        if b'files' not in info:
+            return self.get_v2_files(name, tree_files)
+
+        files = []
+        offset = 0
+        for file in info[b'files']:
+            parts = [part.decode('utf-8', errors='ignore') for part in file[b'path']]
+            files.append({
+                'path': os.path.join(name, *parts),
+                'length': file[b'length'],
+                'offset': offset,
+                'pad': b'p' in file.get(b'attr', b''),  # BEP 47 pad file (hybrid torrents)
+                'pieces_root': tree_files.get(tuple(parts), {}).get(b'pieces root')
+            })
+            offset += file[b'length']
+        return files
+    
+    def get_file_tree(self):
+        """Flatten the v2 `file tree` into {path parts: {b'length', b'pieces root'}}"""
+        leaves = {}
+        
+        def walk(node, parts):
+            for key in sorted(node):
+                child = node[key]
+                child_parts = parts + (key.decode('utf-8', errors='ignore'),)
+                if b'' in child:
+                    leaves[child_parts] = child[b'']
+                else:
+                    walk(child, child_parts)
+        
+        walk(self.metadata[b'info'][b'file tree'], ())
+        return leaves
+    
+    def get_v2_files(self, name, tree_files):
+        """Pure v2 layout: every file starts on a piece boundary"""
+        piece_length = self.metadata[b'info'][b'piece length']
+        files = []
+        offset = 0
+        for parts, leaf in tree_files.items():
+            length = leaf[b'length']
+            # A single-file torrent's tree is just {name: file}
+            path = name if len(tree_files) == 1 and parts == (name,) else os.path.join(name, *parts)
+            files.append({
+                'path': path,
+                'length': length,
+                'offset': offset,
+                'pad': False,
+                'pieces_root': leaf.get(b'pieces root')
+            })
+            offset += -(-length // piece_length) * piece_length
+        return files
+    
+    def get_v2_piece_info(self):
+        """Map piece index -> v2 Merkle data (file root, position, expected piece hash)"""
+        piece_length = self.metadata[b'info'][b'piece length']
+        blocks_per_piece = piece_length // MERKLE_BLOCK_SIZE
+        layers = self.metadata.get(b'piece layers', {})
+        pieces = {}
+        for file_index, file in enumerate(self.get_files()):
+            root = file['pieces_root']
+            if not root or file['length'] == 0:
+                continue
+            first = file['offset'] // piece_length
+            count = -(-file['length'] // piece_length)
+            if count == 1:
+                # Files up to one piece long: the pieces root is the piece hash
+                width = next_power_of_two(-(-file['length'] // MERKLE_BLOCK_SIZE))
+                hashes = [root]
+            else:
+                width = blocks_per_piece
+                hashes = self.get_piece_layer(layers.get(root), root, count, blocks_per_piece)
+            for n in range(count):
+                pieces[first + n] = {
+                    'root': root,
+                    'file_index': file_index,
+                    'piece_in_file': n,
+                    'piece_count': count,
+                    'hash_v2': hashes[n],
+                    'width': width,
+                    'data_length': min(piece_length, file['length'] - n * piece_length),
+                    'block_hashes': None,  # Leaf layer, fetched with a hash request when needed
+                    'data_block_hashes': None
+                }
+        return pieces
+    
+    def get_piece_layer(self, layer, root, count, blocks_per_piece):
+        """Split a `piece layers` entry into hashes, if it is present and matches the root"""
+        if not layer or len(layer) != count * 32:
+            return [None] * count
+        hashes = [layer[i:i+32] for i in range(0, len(layer), 32)]
+        pad = zero_subtree_hash(blocks_per_piece.bit_length() - 1)
+        if merkle_root(hashes, next_power_of_two(count), pad) != root:
+            print("✗ Piece layer does not match its pieces root - will request it from peers")
+            return [None] * count
+        return hashes
+
+# This class is added to publish data: build .torrent files (single or multi-file) from local files
+class TorrentCreator:
+    def __init__(self, path, announce_urls=(), web_seeds=(), piece_length=None, private=False,
+                 comment=None, workers=None):
+        self.path = os.path.abspath(path)
+        # Each URL is its own tier, or pass lists of URLs as tiers
+        self.announce_tiers = [[url] if isinstance(url, str) else list(url) for url in announce_urls]
+        self.web_seeds = list(web_seeds)
+        self.private = private
+        self.comment = comment
+        self.workers = workers or os.cpu_count() or 1
+        if piece_length is not None and (piece_length < MIN_PIECE_LENGTH or piece_length & (piece_length - 1)):
+            raise ValueError(f"piece length must be a power of two of at least {MIN_PIECE_LENGTH // 1024} KiB, "
+                             f"got {piece_length}")
+        self.files = self.scan_files()  # [{'path': [...], 'full_path', 'length', 'offset'}]
+        self.total_size = sum(f['length'] for f in self.files)
+        if self.total_size == 0:
+            raise ValueError(f"nothing to share: {self.path} contains no data")
+        self.file_offsets = [f['offset'] for f in self.files]
+        self.piece_length = piece_length or choose_piece_length(self.total_size)
+        self.num_pieces = -(-self.total_size // self.piece_length)
+    
+    def is_single_file(self):
+        return os.path.isfile(self.path)
+    
+    def scan_files(self):
+        if self.is_single_file():
+            paths = [(self.path, [os.path.basename(self.path)])]
+        elif os.path.isdir(self.path):
+            paths = []
+            for root, dirs, names in os.walk(self.path):
+                for name in names:
+                    full_path = os.path.join(root, name)
+                    if os.path.isfile(full_path):
+                        paths.append((full_path, os.path.relpath(full_path, self.path).split(os.sep)))
+            paths.sort(key=lambda item: item[1])  # Stable order: sorted by path components
+        else:
+            raise FileNotFoundError(f"No such file or directory: {self.path}")
+        
+        files = []
+        offset = 0
+        for full_path, parts in paths:
+            length = os.path.getsize(full_path)
+            files.append({'path': parts, 'full_path': full_path, 'length': length, 'offset': offset})
+            offset += length
+        return files
+    
+    def hash_pieces_range(self, first_piece, last_piece):
+        """SHA-1 of pieces [first_piece, last_piece) - runs on a worker thread
+        
+        Files are memory-mapped (falling back to large reads) and hashed through
+        memoryviews without copies; hashlib drops the GIL, so workers use all cores.
+        """
+        piece_length = self.piece_length
+        start = first_piece * piece_length
+        end = min(last_piece * piece_length, self.total_size)
+        digests = []
+        sha = hashlib.sha1()
+        filled = 0
+        
+        def feed(data):
+            nonlocal sha, filled
+            while data:
+                take = min(len(data), piece_length - filled)
+                sha.update(data[:take])
+                filled += take
+                data = data[take:]
+                if filled == piece_length:
+                    digests.append(sha.digest())
+                    sha = hashlib.sha1()
+                    filled = 0
+        
+        file_index = max(0, bisect_right(self.file_offsets, start) - 1)
+        pos = start
+        while pos < end and file_index < len(self.files):
+            file = self.files[file_index]
+            file_start = pos - file['offset']
+            file_end = min(file['length'], end - file['offset'])
+            if file_end > file_start:
+                with open(file['full_path'], 'rb') as f:
+                    try:
+                        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    except (OSError, ValueError):
+                        mapped = None
+                    if mapped is not None:
+                        with mapped:
+                            if hasattr(mapped, 'madvise'):
+                                mapped.madvise(mmap.MADV_SEQUENTIAL)
+                            with memoryview(mapped) as view:
+                                feed(view[file_start:file_end])
+                    else:
+                        f.seek(file_start)
+                        buffer = bytearray(HASH_READ_SIZE)
+                        remaining = file_end - file_start
+                        while remaining > 0:
+                            n = f.readinto(memoryview(buffer)[:min(remaining, HASH_READ_SIZE)])
+                            if not n:
+                                raise IOError(f"{file['full_path']} changed while hashing")
+                            feed(memoryview(buffer)[:n])
+                            remaining -= n
+                pos = file['offset'] + file_end
+            file_index += 1
+        if filled:
+            digests.append(sha.digest())  # Last, shorter piece
+        return digests
+    
+    def hash_pieces(self, progress=None):
+        """Hash all pieces in parallel; progress(bytes_hashed, total_bytes) is called as jobs finish"""
+        pieces_per_job = max(1, HASH_JOB_SIZE // self.piece_length)
+        jobs = [(first, min(first + pieces_per_job, self.num_pieces))
+                for first in range(0, self.num_pieces, pieces_per_job)]
+        results = [None] * len(jobs)
+        hashed = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hash') as executor:
+            futures = {executor.submit(self.hash_pieces_range, first, last): n
+                       for n, (first, last) in enumerate(jobs)}
+            for future in as_completed(futures):
+                n = futures[future]
+                results[n] = future.result()
+                first, last = jobs[n]
+                hashed += min(last * self.piece_length, self.total_size) - first * self.piece_length
+                if progress:
+                    progress(hashed, self.total_size)
+        return b''.join(digest for digests in results for digest in digests)
+    
+    def build(self, progress=None):
+        """Return the torrent's metadata dict (bencodepy-ready)"""
+        info = {
+            b'name': os.path.basename(self.path).encode('utf-8'),
+            b'piece length': self.piece_length,
+            b'pieces': self.hash_pieces(progress),
+        }
+        if self.is_single_file():
+            info[b'length'] = self.total_size
+        else:
+            info[b'files'] = [{b'length': f['length'], b'path': [part.encode('utf-8') for part in f['path']]}
+                              for f in self.files]
+        if self.private:
+            info[b'private'] = 1
+        
+        metadata = {b'info': info, b'created by': b'python-torrent-client',
+                    b'creation date': int(time.time())}
+        if self.announce_tiers:
+            metadata[b'announce'] = self.announce_tiers[0][0].encode()
+            metadata[b'announce-list'] = [[url.encode() for url in tier] for tier in self.announce_tiers]
+        if self.web_seeds:
+            metadata[b'url-list'] = [url.encode() for url in self.web_seeds]
+        if self.comment:
+            metadata[b'comment'] = self.comment.encode('utf-8')
+        return metadata
+    
+    def save(self, output, progress=None):
+        """Hash the data and write the .torrent file; returns the v1 info hash"""
+        import bencodepy
+        metadata = self.build(progress)
+        with open(output, 'wb') as f:
+            f.write(bencodepy.encode(metadata))
+        return hashlib.sha1(bencodepy.encode(metadata[b'info'])).digest()
 
 class Tracker:
     def __init__(self, torrent_parser):
         self.parser = torrent_parser
         self.peers = []
-        
+        self.alternate_addresses = {}  # (ip, port) -> other-family addresses of the same peer id
+        self.peer_ids = {}  # peer id -> first (ip, port) seen in a dictionary-model peer list
+
     def generate_peer_id(self):
         return '-PC0001-' + ''.join([str(random.randint(0, 9)) for _ in range(12)])
     
-    def get_best_peers(self, max_peers=30):  # Increased to 30 peers
+    def get_best_peers(self, max_peers=30, prefer_family='ipv6'):  # Increased to 30 peers
         """Get peers with focus on those that might accept web ports"""
         
         # Prioritize peers from major cloud providers and datacenters
@@ -251,6 +1268,8 @@ class Tracker:
                 preferred.append((ip, port))
             else:
                 regular.append((ip, port))
+        # Mix both address families so neither gets crowded out
+        regular = interleave_by_family(regular, prefer_family)
         
         # Take more preferred peers since we're being aggressive
         preferred_count = min(int(max_peers * 0.8), len(preferred))
@@ -271,18 +1290,24 @@ class Tracker:
         params = {
             'info_hash': info_hash,
             'peer_id': peer_id,
-            'port': 6881,
+            'port': LISTEN_PORT,
             'uploaded': 0,
             'downloaded': 0,
             'left': self.parser.get_file_size(),
             'compact': 1,
             'event': 'started'
         }
+        # BEP 7: tell the tracker our IPv6 address so it hands out (and to) IPv6 peers
+        ipv6 = get_public_ipv6()
+        if ipv6:
+            params['ipv6'] = ipv6
         
         try:
             announce_url = self.parser.get_announce_url()
             print(f"🔗 Contacting tracker: {announce_url}")
             
+            import bencodepy
+            import requests
             response = requests.get(announce_url, params=params, timeout=30)
             response_data = bencodepy.decode(response.content)
             
@@ -290,27 +1315,57 @@ class Tracker:
                 print(f"✗ Tracker error: {response_data[b'failure reason'].decode()}")
                 return False
                 
-            self.parse_peers(response_data.get(b'peers', b''))
-            print(f"✓ Found {len(self.peers)} peers from tracker")
+            self.parse_peers(response_data.get(b'peers', b''), response_data.get(b'peers6', b''))
+            ipv6_count = sum(1 for ip, port in self.peers if family_of(ip) == 'ipv6')
+            print(f"✓ Found {len(self.peers)} peers from tracker "
+                  f"({len(self.peers) - ipv6_count} IPv4, {ipv6_count} IPv6)")
             return True
             
         except Exception as e:
             print(f"✗ Tracker communication failed: {e}")
             return False
     
-    def parse_peers(self, peers_data):
+    def parse_peers(self, peers_data, peers6_data=b''):
         self.peers = []
+        self.alternate_addresses = {}
+        self.peer_ids = {}
         try:
-            # Compact format: 6 bytes per peer (4 IP + 2 port)
-            for i in range(0, len(peers_data), 6):
-                ip_bytes = peers_data[i:i+4]
-                port_bytes = peers_data[i+4:i+6]
-                
-                ip = '.'.join(str(b) for b in ip_bytes)
-                port = struct.unpack('>H', port_bytes)[0]
-                self.peers.append((ip, port))
+            if isinstance(peers_data, list):
+                self.parse_peer_dicts(peers_data)
+            else:
+                # Compact format: 6 bytes per peer (4 IP + 2 port)
+                usable = len(peers_data) - len(peers_data) % 6
+                self.peers = [(socket.inet_ntoa(ip_bytes), port)
+                              for ip_bytes, port in struct.iter_unpack('>4sH', peers_data[:usable])]
+            if isinstance(peers6_data, list):
+                self.parse_peer_dicts(peers6_data)
+            else:
+                # BEP 7 compact IPv6: 18 bytes per peer (16 IP + 2 port)
+                usable = len(peers6_data) - len(peers6_data) % 18
+                self.peers.extend((socket.inet_ntop(socket.AF_INET6, ip_bytes), port)
+                                  for ip_bytes, port in struct.iter_unpack('>16sH', peers6_data[:usable]))
         except Exception as e:
             print(f"✗ Error parsing peers: {e}")
+    
+    def parse_peer_dicts(self, peer_list):
+        """Dictionary model: [{'peer id', 'ip', 'port'}], a peer id seen on both families is one peer"""
+        for entry in peer_list:
+            if not isinstance(entry, dict) or b'ip' not in entry or b'port' not in entry:
+                continue
+            ip = entry[b'ip'].decode(errors='replace').strip('[]')
+            address = (ip, entry[b'port'])
+            peer_id = entry.get(b'peer id')
+            first = self.peer_ids.get(peer_id) if peer_id else None
+            if first is None:
+                if peer_id:
+                    self.peer_ids[peer_id] = address
+                self.peers.append(address)
+            elif address != first and address not in self.alternate_addresses.setdefault(first, []):
+                # Same peer on its other address family: dialed together (Happy Eyeballs)
+                self.alternate_addresses[first].append(address)
+    
+    def get_peer_addresses(self, peer):
+        return [peer] + self.alternate_addresses.get(peer, [])
             
     # Add this method to your Tracker class:
     def get_preferred_peers(self, max_peers=10):
@@ -332,8 +1387,148 @@ class Tracker:
         
         return result
 
+# This class is added to find peers on the local network (BEP 14) without asking the tracker
+class LocalServiceDiscovery(asyncio.DatagramProtocol):
+    def __init__(self, info_hashes, port, on_peer, interface=LSD_INTERFACE):
+        self.info_hashes = {info_hash.hex() for info_hash in info_hashes}
+        self.port = port  # Our listening port, sent in every announce
+        self.on_peer = on_peer  # on_peer(ip, port, info_hash) for every new LAN peer
+        self.interface = interface
+        self.cookie = '%08x' % random.getrandbits(32)  # Recognizes our own looped-back announces
+        self.transports = []  # (transport, multicast group)
+        self.known_peers = set()  # (cookie or (ip, port), info hash)
+        self.last_announce = 0
+        self.deferred_announce = None
+        self.announce_task = None
+        self.announces_sent = 0
+    
+    def build_announce(self, group):
+        host = f"[{group}]" if ':' in group else group
+        lines = ['BT-SEARCH * HTTP/1.1', f'Host: {host}:{LSD_PORT}', f'Port: {self.port}']
+        lines += [f'Infohash: {info_hash}' for info_hash in sorted(self.info_hashes)]
+        lines.append(f'cookie: {self.cookie}')
+        return ('\r\n'.join(lines) + '\r\n\r\n\r\n').encode()
+    
+    @staticmethod
+    def parse_announce(data):
+        """Return (port, info hashes, cookie) from a BT-SEARCH message, or None"""
+        try:
+            lines = data.decode('ascii').split('\r\n')
+        except UnicodeDecodeError:
+            return None
+        if not lines[0].startswith('BT-SEARCH * HTTP/1.1'):
+            return None
+        port, info_hashes, cookie = None, [], None
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == 'port' and value.isdigit():
+                port = int(value)
+            elif name == 'infohash' and len(value) in (40, 64):
+                info_hashes.append(value[:40])  # v2 hashes are truncated like in the handshake
+            elif name == 'cookie':
+                cookie = value
+        if not port or port > 65535 or not info_hashes:
+            return None
+        return port, info_hashes, cookie
+    
+    def create_socket(self, family):
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            # Several clients on one machine share the port (and loopback tests need it)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            if family == socket.AF_INET:
+                sock.bind(('', LSD_PORT))
+                interface = socket.inet_aton(self.interface)
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(LSD_GROUP_IPV4) + interface)
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            else:
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+                sock.bind(('', LSD_PORT))
+                membership = socket.inet_pton(socket.AF_INET6, LSD_GROUP_IPV6) + struct.pack('@I', 0)
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, membership)
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_LOOP, 1)
+            sock.setblocking(False)
+            return sock
+        except OSError:
+            sock.close()
+            raise
+    
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        for family, group in ((socket.AF_INET, LSD_GROUP_IPV4), (socket.AF_INET6, LSD_GROUP_IPV6)):
+            try:
+                transport, _ = await loop.create_datagram_endpoint(lambda: self, sock=self.create_socket(family))
+                self.transports.append((transport, group))
+            except OSError as e:
+                print(f"⚠ Local Service Discovery unavailable on {group}: {e}")
+        if not self.transports:
+            return False
+        print(f"🏠 Local Service Discovery on {', '.join(group for _, group in self.transports)}")
+        self.announce_task = asyncio.create_task(self.announce_loop())
+        return True
+    
+    def announce(self, force=False):
+        """Multicast our info hashes; unforced announces are rate limited (and deferred instead)"""
+        now = time.time()
+        wait = self.last_announce + LSD_MIN_ANNOUNCE_INTERVAL - now
+        if not force and wait > 0:
+            if not self.deferred_announce:
+                self.deferred_announce = asyncio.get_running_loop().call_later(wait, self.announce)
+            return False
+        if self.deferred_announce:
+            self.deferred_announce.cancel()
+            self.deferred_announce = None
+        for transport, group in self.transports:
+            try:
+                transport.sendto(self.build_announce(group), (group, LSD_PORT))
+            except OSError as e:
+                print(f"⚠ LSD announce on {group} failed: {e}")
+        self.last_announce = now
+        self.announces_sent += 1
+        return True
+    
+    async def announce_loop(self):
+        while True:
+            self.announce(force=True)
+            await asyncio.sleep(LSD_ANNOUNCE_INTERVAL)
+    
+    def datagram_received(self, data, addr):
+        announce = self.parse_announce(data)
+        if not announce:
+            return
+        port, info_hashes, cookie = announce
+        if cookie == self.cookie:
+            return  # Our own announce, looped back
+        ip = addr[0]
+        # A dual-stack client is heard on both groups; its cookie makes it one peer
+        sender = cookie or (ip, port)
+        for info_hash in info_hashes:
+            if info_hash not in self.info_hashes or (sender, info_hash) in self.known_peers:
+                continue
+            self.known_peers.add((sender, info_hash))
+            self.on_peer(ip, port, bytes.fromhex(info_hash))
+            # Let the newcomer learn about us too (rate limited)
+            self.announce()
+    
+    def error_received(self, exc):
+        print(f"⚠ LSD socket error: {exc}")
+    
+    def close(self):
+        if self.announce_task:
+            self.announce_task.cancel()
+        if self.deferred_announce:
+            self.deferred_announce.cancel()
+        for transport, _ in self.transports:
+            transport.close()
+        self.transports = []
+
 class PeerProtocol:
-    def __init__(self, info_hash, peer_id, file_writer=None, piece_manager=None):  # Add these
+    def __init__(self, info_hash, peer_id, file_writer=None, piece_manager=None, memory_budget=None,
+                 peer_stats=None):  # Add these
         self.info_hash = info_hash
         self.peer_id = peer_id.encode() if isinstance(peer_id, str) else peer_id
         self.bitfield = None
@@ -345,41 +1540,306 @@ class PeerProtocol:
         # Add these references:
         self.file_writer = file_writer
         self.piece_manager = piece_manager
-
+        self.memory_budget = memory_budget
+        self.peer_stats = peer_stats
+        self.ip = None
+        self.family = None  # 'ipv4' / 'ipv6' of the address that connected
+        # Request pipeline: blocks waiting to be requested and blocks in flight
+        self.pending_blocks = deque()  # (piece_index, begin, length)
+        self.outstanding_requests = {}  # (piece_index, begin) -> length
+        self.active_pieces = set()  # Pieces this peer is currently fetching
+        # Health tracking for request timeouts and snub detection
+        self.peer_choking = True
+        self.snubbed = False
+        self.rtt = None  # Smoothed request -> block latency in seconds
+        self.failed_blocks = set()  # Blocks that timed out on this peer
+        self.sent_hash_requests = set()  # v2 hash requests waiting for this peer's answer
+        self.block_hash_requests = {}  # (root, 0, index) -> (piece_index, sent time) for failed v2 pieces
+        self.supports_v2 = False  # Peer set the BEP 52 bit in its handshake
+        self.last_data_time = time.time()
+        self.last_timeout_time = 0  # When requests last expired
+        self.last_sent_time = time.time()
+        # Outbound queue: control messages queued in one loop iteration leave in one write
+        self.outbound = []
+        self.flush_handle = None
+        self.messages_sent = 0
+        self.write_calls = 0
+        # Read timeouts are enforced by the watchdog, so buffered messages are read without a task each
+        self.last_received_time = time.time()
+        self.message_started = None  # When the length prefix of a still incomplete message arrived
+        self.timed_out = False
+        self.reading_paused = False  # Not reading while the memory budget is exhausted
         
-    async def request_piece(self, piece_index, block_offset, block_length=16384):
-    #"""Request a specific block from a piece"""
-        request_msg = struct.pack('>IBIII', 13, 6, piece_index, block_offset, block_length)
-        self.writer.write(request_msg)
-        await self.writer.drain()
-
+    def send_message(self, message):
+        """Queue a message; the queue is flushed once the current loop iteration is done"""
+        self.outbound.append(message)
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_soon(self.flush_outbound)
+    
+    def flush_outbound(self):
+        self.flush_handle = None
+        if not self.outbound:
+            return
+        messages, self.outbound = self.outbound, []
+        if not self.writer or self.writer.is_closing():
+            return
+        self.writer.write(b''.join(messages))
+        self.messages_sent += len(messages)
+        self.write_calls += 1
+        self.last_sent_time = time.time()
+    
+    async def drain_outbound(self):
+        """Wait for the socket only once the transport buffers more than its high-water mark"""
+        transport = self.writer.transport
+        if transport.get_write_buffer_size() > transport.get_write_buffer_limits()[1]:
+            self.flush_outbound()
+            await self.writer.drain()
+    
     async def download_piece(self, piece_index, piece_size, piece_manager):
     #"""Download an entire piece"""
         block_size = 16384  # 16KB blocks
         downloaded = 0
+        self.active_pieces.add(piece_index)
+        if piece_manager:
+            piece_manager.claim_piece(piece_index)
     
         while downloaded < piece_size:
             block_length = min(block_size, piece_size - downloaded)
-            await self.request_piece(piece_index, downloaded, block_length)
-            # Wait for piece message will be handled in process_message
+            self.pending_blocks.append((piece_index, downloaded, block_length))
             downloaded += block_length
+        
+        # Blocks go out as the pipeline (and memory budget) allows
+        await self.fill_requests()
+    
+    def is_unresponsive(self):
+        """Snubbed, or requests timed out with no data since: one probe block at a time, no new pieces"""
+        return self.snubbed or self.last_timeout_time > self.last_data_time
+    
+    def get_request_depth(self):
+        if self.is_unresponsive():
+            return 1  # Deprioritized until it sends data again
+        if self.memory_budget:
+            return self.memory_budget.request_depth(MAX_REQUEST_DEPTH)
+        return MAX_REQUEST_DEPTH
+    
+    async def fill_requests(self):
+        """Keep up to request-depth blocks outstanding with this peer"""
+        depth = self.get_request_depth()
+        while len(self.outstanding_requests) < depth:
+            block = None
+            if self.piece_manager:
+                # Blocks reassigned from slow peers go first
+                block = self.piece_manager.take_orphan_block(self.can_take_block)
+            if block is None and self.pending_blocks:
+                block = self.pending_blocks.popleft()
+            if block is None and self.piece_manager and self.snubbed:
+                # Probe a snubbed peer with a block it timed out on (other peers had SNUB_TIMEOUT
+                # to take it) rather than claiming new pieces
+                block = self.piece_manager.take_orphan_block(lambda block: self.has_piece(block[0]))
+            if block is None:
+                break
+            piece_index, begin, length = block
+            self.active_pieces.add(piece_index)
+            self.outstanding_requests[(piece_index, begin)] = (length, time.time())
+            await self.request_piece(piece_index, begin, length)
+    
+    async def queue_next_piece(self, start=0):
+        """Pick the next wanted piece for this peer; False when nothing is left"""
+        if not self.piece_manager:
+            return False
+        next_pieces = self.piece_manager.pick_pieces(1, start, exclude=self.active_pieces)
+        if not next_pieces:
+            return False
+        next_piece = next_pieces[0]
+        next_piece_size = self.piece_manager.pieces[next_piece]['size']
+        print(f"🎯 Starting download of piece {next_piece} (size: {next_piece_size} bytes)")
+        await self.download_piece(next_piece, next_piece_size, self.piece_manager)
+        return True
+    
+    def can_take_block(self, block):
+        """Reassigned blocks: only pieces the peer has, never one it already timed out on"""
+        return self.has_piece(block[0]) and block not in self.failed_blocks
+    
+    def has_piece(self, piece_index):
+        if self.bitfield is None:
+            return True  # No bitfield yet, assume a seeder
+        byte_index = piece_index // 8
+        if byte_index >= len(self.bitfield):
+            return False
+        return bool(self.bitfield[byte_index] & (0x80 >> (piece_index % 8)))
+    
+    def get_request_timeout(self):
+        if self.rtt is None:
+            return MAX_REQUEST_TIMEOUT
+        return min(MAX_REQUEST_TIMEOUT, max(MIN_REQUEST_TIMEOUT, self.rtt * REQUEST_TIMEOUT_RTT_FACTOR))
+    
+    def release_blocks(self, include_pending=True):
+        """Give outstanding (and queued) blocks back to the piece manager for other peers"""
+        blocks = [(piece, begin, entry[0]) for (piece, begin), entry in self.outstanding_requests.items()]
+        self.outstanding_requests = {}
+        if include_pending:
+            blocks.extend(self.pending_blocks)
+            self.pending_blocks.clear()
+            self.active_pieces.clear()
+        if self.piece_manager and blocks:
+            self.piece_manager.return_blocks(blocks)
+        return blocks
+    
+    async def check_timeouts(self):
+        """Reassign requests that took too long and detect a snubbing peer"""
+        now = time.time()
+        timeout = self.get_request_timeout()
+        expired = [key for key, (length, sent) in self.outstanding_requests.items() if now - sent > timeout]
+        if expired:
+            print(f"⏰ {len(expired)} request(s) timed out after {timeout:.1f}s - reassigning")
+            blocks = []
+            for piece_index, begin in expired:
+                length = self.outstanding_requests.pop((piece_index, begin))[0]
+                blocks.append((piece_index, begin, length))
+                self.failed_blocks.add((piece_index, begin, length))
+                await self.cancel_request(piece_index, begin, length)
+            if self.piece_manager:
+                self.piece_manager.return_blocks(blocks)
+            if not self.outstanding_requests:
+                # The whole pipeline timed out: queued blocks go to other peers, this one gets probes
+                self.last_timeout_time = now
+                self.release_blocks()
+        
+        stale = [key for key, (piece_index, sent) in self.block_hash_requests.items()
+                 if now - sent > MAX_REQUEST_TIMEOUT]
+        for key in stale:
+            self.fail_block_hash_request(key)
+        
+        waiting = self.outstanding_requests or self.pending_blocks or expired
+        if not self.snubbed and waiting and now - self.last_data_time > SNUB_TIMEOUT:
+            self.snubbed = True
+            released = self.release_blocks()
+            print(f"🐌 Peer snubbed us (no data for {SNUB_TIMEOUT}s) - reassigned {len(released)} blocks")
+    
+    async def cancel_request(self, piece_index, begin, length):
+        try:
+            # Message format: <length=13><id=8><index><begin><length>
+            self.send_message(struct.pack('>IBIII', 13, 8, piece_index, begin, length))
+        except Exception as e:
+            print(f"✗ Error cancelling request: {e}")
+    
+    async def send_keepalive(self):
+        self.send_message(struct.pack('>I', 0))
+        await self.drain_outbound()
+    
+    def is_read_timed_out(self):
+        now = time.time()
+        if self.message_started is not None:
+            return now - self.message_started > MESSAGE_TIMEOUT
+        return now - self.last_received_time > PEER_IDLE_TIMEOUT
+    
+    async def watchdog(self):
+        """Once a second: expire slow requests, detect snubbing, keep the connection alive"""
+        while self.connected:
+            await asyncio.sleep(1)
+            try:
+                # While memory backpressure stops our reads, replies pile up in the
+                # socket buffer - that silence is not the peer's fault
+                if not self.reading_paused:
+                    if self.is_read_timed_out():
+                        # Closing makes the reader see EOF, which ends the message loop
+                        self.timed_out = True
+                        self.writer.close()
+                        break
+                    await self.check_timeouts()
+                if time.time() - self.last_sent_time >= KEEPALIVE_INTERVAL:
+                    await self.send_keepalive()
+                if self.reading_paused:
+                    continue
+                await self.request_missing_layers()
+                if not self.peer_choking:
+                    # Pick up reassigned blocks, or a fresh piece while idle - a peer whose
+                    # requests just timed out only gets a single probe block
+                    if not self.outstanding_requests and not self.pending_blocks and not self.is_unresponsive():
+                        await self.queue_next_piece()
+                    await self.fill_requests()
+            except Exception as e:
+                print(f"✗ Peer watchdog error: {e}")
+    
+    def is_piece_active(self, piece_index):
+        return (any(key[0] == piece_index for key in self.outstanding_requests)
+                or any(block[0] == piece_index for block in self.pending_blocks))
     
-    async def connect_to_peer(self, ip, port):
-        """Use open web ports (80, 443, 53) to tunnel BitTorrent traffic"""
+    async def open_connection(self, ips, port, timeout=CONNECT_TIMEOUT, outcomes=None):
+        """Happy Eyeballs (RFC 8305): dial the addresses in order, each one HAPPY_EYEBALLS_DELAY
+        (or the previous failure) after the last, and keep whichever connects first.
+        `outcomes` collects ip -> (result, seconds) of every address dialed, for PeerStats.record_race"""
+        if outcomes is None:
+            outcomes = {}
+        started = {}
+        
+        async def attempt(ip):
+            started[ip] = time.time()
+            try:
+                reader, writer = await asyncio.open_connection(ip, port, limit=RECEIVE_BUFFER_LIMIT)
+            except OSError:
+                outcomes[ip] = ('failed', time.time() - started[ip])
+                raise
+            outcomes[ip] = ('connected', time.time() - started[ip])
+            return ip, reader, writer
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        remaining = list(ips)
+        tasks = []
+        winner = None
+        error = None
+        try:
+            while winner is None:
+                if remaining:
+                    tasks.append(asyncio.create_task(attempt(remaining.pop(0))))
+                running = [task for task in tasks if not task.done()]
+                if not running:
+                    break
+                wait = deadline - loop.time()
+                if remaining:
+                    wait = min(wait, HAPPY_EYEBALLS_DELAY)
+                if wait <= 0:
+                    raise asyncio.TimeoutError()
+                done, _ = await asyncio.wait(running, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception():
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task.result()
+        finally:
+            for ip, task in zip(ips, tasks):
+                if not task.done():
+                    task.cancel()
+                    # Lost the race (or timed out): it would have taken at least this long
+                    outcomes[ip] = ('lost', time.time() - started.get(ip, time.time()))
+                elif not task.cancelled() and not task.exception() and task.result() is not winner:
+                    task.result()[2].close()  # Lost the race by a hair
+        if winner is None:
+            raise error or asyncio.TimeoutError()
+        return winner
+    
+    async def connect_to_peer(self, ip, port, alternates=(), direct=False):
+        """Use open web ports (80, 443, 53) to tunnel BitTorrent traffic (LAN peers: `direct`, their own port)"""
         try:
-            print(f"🔗 Connecting to {ip} via web ports...")
+            # Same peer on both families: race them, the faster family first
+            addresses = [(ip, port)] + list(alternates)
+            if self.peer_stats:
+                addresses = interleave_by_family(addresses, self.peer_stats.preferred_family())
+            ips = [address[0] for address in addresses]
+            print(f"🔗 Connecting to {' / '.join(ips)} via {'port ' + str(port) if direct else 'web ports'}...")
             
             # Strategy: Try all open web ports aggressively
-            web_ports = [80, 443, 53]  # These are confirmed OPEN
+            web_ports = [port] if direct else [80, 443, 53]  # These are confirmed OPEN
             connected = False
             
+            outcomes = {}
             for web_port in web_ports:
                 try:
                     print(f"   🌐 Attempting via port {web_port}...")
-                    self.reader, self.writer = await asyncio.wait_for(
-                        asyncio.open_connection(ip, web_port),
-                        timeout=10.0
-                    )
+                    outcomes = {}  # Only the deciding race (the winner, or the last port) feeds the stats
+                    ip, self.reader, self.writer = await self.open_connection(ips, web_port, outcomes=outcomes)
+                    self.ip, self.family = ip, family_of(ip)
                     print(f"   ✅ Connected to {ip} via port {web_port}!")
                     connected = True
                     break
@@ -396,6 +1856,9 @@ class PeerProtocol:
                     print(f"   ⚠️ Port {web_port} unexpected error: {e}")
                     continue
             
+            if self.peer_stats:
+                self.peer_stats.record_race(outcomes)
+            
             if not connected:
                 print(f"❌ All web port attempts failed for {ip}")
                 return False
@@ -429,14 +1892,75 @@ class PeerProtocol:
             print(f"✗ Connection failed: {e}")
             return False
     
+    async def accept_connection(self, reader, writer):
+        """Incoming peer: read its handshake first, then answer with ours"""
+        self.reader, self.writer = reader, writer
+        peername = writer.get_extra_info('peername')
+        self.ip = peername[0] if peername else '?'
+        self.family = family_of(self.ip)
+        try:
+            response = await asyncio.wait_for(reader.readexactly(68), timeout=15.0)
+            if self.parse_handshake(response) != self.info_hash:
+                print(f"✗ Incoming peer {self.ip}: handshake for another torrent")
+                writer.close()
+                return False
+            self.supports_v2 = self.handshake_supports_v2(response)
+            writer.write(self.build_handshake())
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, OSError) as e:
+            print(f"✗ Incoming handshake from {self.ip} failed: {e}")
+            writer.close()
+            return False
+        
+        self.connected = True
+        if self.peer_stats:
+            self.peer_stats.record_incoming(self.family)
+        print(f"🤝 Incoming peer {self.ip} connected ({self.family})")
+        await self.handle_peer_messages()
+        return True
+    
+    def build_handshake(self):
+        reserved = bytearray(8)
+        if self.piece_manager and self.piece_manager.is_v2:
+            reserved[7] |= 0x10  # BEP 52: we speak v2 (hash request messages)
+        return struct.pack('>B19s8s20s20s',
+                           19,
+                           b'BitTorrent protocol',
+                           bytes(reserved),
+                           self.info_hash,
+                           self.peer_id)
+    
+    @staticmethod
+    def parse_handshake(response):
+        """Return the info hash from a 68-byte handshake, or None if it isn't one"""
+        if len(response) < 68 or response[0] != 19 or response[1:20] != b'BitTorrent protocol':
+            return None
+        return response[28:48]
+    
+    @staticmethod
+    def handshake_supports_v2(response):
+        """BEP 52: bit 0x10 of the last reserved byte means the peer answers hash requests"""
+        return len(response) >= 28 and bool(response[27] & 0x10)
+    
+    @staticmethod
+    def build_request(piece_index, begin, length):
+        # Message format: <length=13><id=6><index><begin><length>
+        return struct.pack('>IBIII', 13, 6, piece_index, begin, length)
+    
+    @staticmethod
+    def parse_message(message_data):
+        """Split a length-stripped message into (id, payload)"""
+        return message_data[0], message_data[1:]
+    
+    @staticmethod
+    def parse_piece(payload):
+        """Split a piece message payload into (index, begin, block)"""
+        index, begin = struct.unpack_from('>II', payload)
+        return index, begin, payload[8:]
+    
     async def perform_handshake(self):
         try:
-            handshake = struct.pack('>B19s8s20s20s',
-                                19,
-                                b'BitTorrent protocol',
-                                b'\x00' * 8,
-                                self.info_hash,
-                                self.peer_id)
+            handshake = self.build_handshake()
             
             self.writer.write(handshake)
             await self.writer.drain()
@@ -458,8 +1982,8 @@ class PeerProtocol:
                 return False
                 
             # Verify handshake response
-            response_info_hash = response[28:48]
-            if response_info_hash == self.info_hash:
+            if self.parse_handshake(response) == self.info_hash:
+                self.supports_v2 = self.handshake_supports_v2(response)
                 self.connected = True
                 return True
             else:
@@ -471,40 +1995,70 @@ class PeerProtocol:
             return False
     
     async def handle_peer_messages(self):
+        watchdog_task = None
         try:
             # Send interested message
             interested_msg = struct.pack('>IB', 1, 2)  # length=1, id=2
-            self.writer.write(interested_msg)
-            await self.writer.drain()
+            self.send_message(interested_msg)
+            self.last_sent_time = self.last_data_time = time.time()
+            watchdog_task = asyncio.create_task(self.watchdog())
+            await self.request_missing_layers()
             
             while self.connected:
-                # Read message length
-                length_data = await asyncio.wait_for(self.reader.read(4), timeout=30)
-                if not length_data:
-                    break
-                    
+                # Backpressure: stop reading from the socket while the memory
+                # budget is exhausted (the transport pauses once its buffer fills)
+                if self.memory_budget and self.memory_budget.is_exhausted():
+                    self.reading_paused = True
+                    try:
+                        await self.memory_budget.wait_for_room()
+                    finally:
+                        self.reading_paused = False
+                    # The silence was ours, not the peer's
+                    self.last_received_time = time.time()
+                
+                # Read message length (idle-but-healthy peers send keep-alives). No wait_for():
+                # buffered messages are handled back to back and their replies leave in one write
+                length_data = await self.reader.readexactly(4)
+                self.last_received_time = time.time()
                 length = struct.unpack('>I', length_data)[0]
                 
                 if length == 0:
                     # Keep-alive message
                     continue
+                if length > MAX_MESSAGE_LENGTH:
+                    print(f"✗ Message too large from peer: {length} bytes")
+                    break
                 
                 # Read message ID and payload
-                message_data = await asyncio.wait_for(self.reader.read(length), timeout=30)
-                if not message_data:
-                    break
+                if self.memory_budget:
+                    self.memory_budget.reserve('receive', length)
+                try:
+                    self.message_started = self.last_received_time
+                    message_data = await self.reader.readexactly(length)
+                    self.message_started = None
+                    message_id, payload = self.parse_message(message_data)
                     
-                message_id = message_data[0]
-                payload = message_data[1:] if len(message_data) > 1 else b''
-                
-                await self.process_message(message_id, payload)
+                    await self.process_message(message_id, payload)
+                finally:
+                    if self.memory_budget:
+                        self.memory_budget.release('receive', length)
                 
         except asyncio.TimeoutError:
             print("⚠ Peer connection timeout")
+        except asyncio.IncompleteReadError:
+            print("⚠ Peer connection timeout" if self.timed_out else "⚠ Peer closed the connection")
         except Exception as e:
             print(f"✗ Error handling peer messages: {e}")
         finally:
             self.connected = False
+            if watchdog_task:
+                watchdog_task.cancel()
+            # Whatever we still expected from this peer goes to the other peers
+            self.release_blocks()
+            if self.piece_manager:
+                self.piece_manager.hash_requests -= self.sent_hash_requests
+                for key in list(self.block_hash_requests):
+                    self.fail_block_hash_request(key)
             if self.writer:
                 self.writer.close()
                 await self.writer.wait_closed()
@@ -519,6 +2073,7 @@ class PeerProtocol:
                 
             elif message_id == 1:  # unchoke
                 print("✅ Peer unchoked us - we can request pieces!")
+                self.peer_choking = False
                 # Start downloading if we were waiting for unchoke
                 if not self.downloading:
                     await self.start_downloading()
@@ -526,6 +2081,9 @@ class PeerProtocol:
             elif message_id == 0:  # choke
                 print("❌ Peer choked us")
                 self.downloading = False
+                self.peer_choking = True
+                # A choking peer discards our requests - let other peers have them
+                self.release_blocks()
                 
             elif message_id == 4:  # have
                 piece_index = struct.unpack('>I', payload)[0]
@@ -533,15 +2091,40 @@ class PeerProtocol:
                 
             elif message_id == 7:  # piece
                 # This is where actual data transfer happens
-                index = struct.unpack('>I', payload[0:4])[0]
-                begin = struct.unpack('>I', payload[4:8])[0]
-                block_data = payload[8:]
+                index, begin, block_data = self.parse_piece(payload)
                 
                 print(f"📥 Received piece {index}, block {begin}, size: {len(block_data)} bytes")
                 
                 # ✅ ACTUAL DOWNLOAD LOGIC - Add this:
                 await self.handle_downloaded_block(index, begin, block_data)
                 
+            elif message_id == 21:  # hash request (BEP 52) - we don't serve hashes yet
+                self.send_message(struct.pack('>IB', 1 + len(payload), 23) + payload)
+                
+            elif message_id == 22:  # hashes
+                root, base_layer, index, length, proof_layers = struct.unpack('>32sIIII', payload[:48])
+                hash_data = payload[48:]
+                hashes = [hash_data[i:i+32] for i in range(0, length * 32, 32)]
+                proof = [hash_data[i:i+32] for i in range(length * 32, len(hash_data), 32)]
+                self.sent_hash_requests.discard((root, base_layer, index))
+                self.block_hash_requests.pop((root, base_layer, index), None)
+                print(f"🌳 Received {len(hashes)} hashes (layer {base_layer}, index {index})")
+                if self.piece_manager:
+                    ready = self.piece_manager.handle_hashes(root, base_layer, index, length, hashes, proof)
+                    for piece_index in ready:
+                        asyncio.create_task(self.verify_piece(piece_index))
+                    await self.fill_requests()
+                    
+            elif message_id == 23:  # hash reject
+                root, base_layer, index = struct.unpack('>32sII', payload[:40])
+                print(f"⚠ Peer rejected hash request (layer {base_layer}, index {index})")
+                self.sent_hash_requests.discard((root, base_layer, index))
+                if self.piece_manager:
+                    self.piece_manager.hash_requests.discard((root, base_layer, index))
+                    if (root, base_layer, index) in self.block_hash_requests:
+                        self.fail_block_hash_request((root, base_layer, index))
+                        await self.fill_requests()
+                
         except Exception as e:
             print(f"✗ Error processing message: {e}")
 
@@ -550,19 +2133,18 @@ class PeerProtocol:
         self.downloading = True
         print("🚀 Starting download sequence...")
         
-        # Request multiple pieces
-        for piece_index in range(3):  # Start with first 3 pieces
-            if self.piece_manager and not self.piece_manager.pieces[piece_index]['downloaded']:
+        # Request multiple pieces, skipping pieces that only cover skipped files
+        if self.piece_manager:
+            for piece_index in self.piece_manager.pick_pieces(3, exclude=self.active_pieces):  # Start with 3 pieces
                 piece_size = self.piece_manager.pieces[piece_index]['size']
                 await self.download_piece(piece_index, piece_size, self.piece_manager)
 
     async def request_piece(self, piece_index, begin, length):
         """Send request for a piece block"""
         try:
-            # Message format: <length=13><id=6><index><begin><length>
-            request_msg = struct.pack('>IBIII', 13, 6, piece_index, begin, length)
-            self.writer.write(request_msg)
-            await self.writer.drain()
+            request_msg = self.build_request(piece_index, begin, length)
+            self.send_message(request_msg)
+            await self.drain_outbound()
             print(f"📤 Requested piece {piece_index}, offset {begin}")
         except Exception as e:
             print(f"✗ Error requesting piece: {e}")
@@ -576,16 +2158,18 @@ class PeerProtocol:
             if self.file_writer:
                 try:
                     # Calculate actual file position
-                    piece_length = 16384  # Standard piece size
+                    piece_length = self.piece_manager.piece_length if self.piece_manager else 16384
                     file_position = (piece_index * piece_length) + block_offset
                     
-                    # Write to file
-                    self.file_writer.write_piece(piece_index, block_data, file_position)
-                    print(f"💾 SAVED: Piece {piece_index}, Offset {block_offset} -> File pos {file_position}")
+                    # Queue the write on the disk thread (write-back cache)
+                    self.file_writer.queue_write(piece_index, block_data, file_position)
+                    print(f"💾 QUEUED: Piece {piece_index}, Offset {block_offset} -> File pos {file_position}")
                     
                     # Update progress tracker if available
                     if hasattr(self.file_writer, 'client') and self.file_writer.client.progress_tracker:
                         self.file_writer.client.progress_tracker.update(len(block_data))
+                    if self.peer_stats and self.family:
+                        self.peer_stats.record_download(self.family, len(block_data))
                         
                 except Exception as file_error:
                     print(f"✗ File write error: {file_error}")
@@ -598,48 +2182,99 @@ class PeerProtocol:
                 is_piece_complete = self.piece_manager.mark_block_received(piece_index, block_offset, len(block_data))
                 
                 if is_piece_complete:
-                    print(f"✅ Piece {piece_index} completed and marked as downloaded")
-                    
-                    # Show progress update
-                    downloaded_count = len(self.piece_manager.downloaded_pieces)
-                    total_count = len(self.piece_manager.pieces)
-                    print(f"📊 Progress: {downloaded_count}/{total_count} pieces downloaded")
-            
-            # 3. Request next block
-            block_size = 16384
-            next_offset = block_offset + len(block_data)
-            
-            # Check if we should continue with current piece or move to next
-            current_piece_size = 16384  # Standard piece size
+                    # Hash check runs on the disk thread after the piece's queued writes
+                    asyncio.create_task(self.verify_piece(piece_index))
             
-            if next_offset < current_piece_size:
-                # Continue with current piece - request next block
-                print(f"🔄 Requesting next block of piece {piece_index} at offset {next_offset}")
-                await self.request_piece(piece_index, next_offset, block_size)
-            else:
-                # Current piece is complete, move to next piece
+            # 3. Keep the request pipeline full
+            now = time.time()
+            request = self.outstanding_requests.pop((piece_index, block_offset), None)
+            if request:
+                # Smoothed RTT drives the per-request timeout
+                sample = now - request[1]
+                self.rtt = sample if self.rtt is None else 0.8 * self.rtt + 0.2 * sample
+            self.last_data_time = now
+            if self.snubbed:
+                print("🐇 Peer is sending data again - no longer snubbed")
+                self.snubbed = False
+                self.failed_blocks.clear()  # Blocks that timed out while it was silent get another chance
+            if not self.is_piece_active(piece_index):
+                self.active_pieces.discard(piece_index)
                 print(f"✅ Finished piece {piece_index}, moving to next piece...")
-                
-                next_piece = piece_index + 1
-                if self.piece_manager and next_piece < len(self.piece_manager.pieces):
-                    next_piece_size = self.piece_manager.pieces[next_piece]['size']
-                    print(f"🎯 Starting download of piece {next_piece} (size: {next_piece_size} bytes)")
-                    await self.download_piece(next_piece, next_piece_size, self.piece_manager)
-                else:
+            
+            if not self.pending_blocks and self.piece_manager:
+                # Follow file priorities: skipped pieces are never requested
+                if not await self.queue_next_piece(piece_index + 1) and not self.outstanding_requests:
                     print("🎉 All available pieces downloaded from this peer!")
                     self.downloading = False
+            
+            await self.fill_requests()
                     
         except Exception as e:
             print(f"✗ Error in handle_downloaded_block: {e}")
             # Try to continue with next request despite error
             try:
-                block_size = 16384
-                next_offset = block_offset + len(block_data)
-                if next_offset < 16384:  # Simple boundary check
-                    await self.request_piece(piece_index, next_offset, block_size)
+                await self.fill_requests()
             except Exception as retry_error:
                 print(f"✗ Could not recover from error: {retry_error}")
 
+    async def verify_piece(self, piece_index):
+        """Verify a complete piece and refetch only what turned out to be corrupt"""
+        try:
+            if self.file_writer:
+                result = await self.file_writer.verify_piece(self.piece_manager, piece_index)
+            else:
+                result = {'ok': True}  # Nothing on disk to check
+            status = self.piece_manager.apply_verification(piece_index, result)
+            
+            if status == 'verified':
+                print(f"✅ Piece {piece_index} verified and marked as downloaded")
+                
+                # Show progress update
+                downloaded_count = len(self.piece_manager.downloaded_pieces)
+                total_count = len(self.piece_manager.pieces)
+                print(f"📊 Progress: {downloaded_count}/{total_count} pieces downloaded")
+            elif status == 'waiting':
+                print(f"⏳ Piece {piece_index} complete, waiting for its piece layer hashes")
+            elif status == 'need_hashes':
+                if self.supports_v2 and self.connected:
+                    print(f"✗ Piece {piece_index} failed Merkle check - requesting block hashes")
+                    request = self.piece_manager.get_block_hash_request(piece_index)
+                    self.block_hash_requests[request[:3]] = (piece_index, time.time())
+                    await self.send_hash_request(*request)
+                else:
+                    print(f"✗ Piece {piece_index} failed Merkle check - refetching the whole piece")
+                    self.piece_manager.refetch_piece(piece_index)
+                    await self.fill_requests()
+            else:
+                print(f"✗ Piece {piece_index} failed hash check - refetching bad blocks")
+                await self.fill_requests()
+        except Exception as e:
+            print(f"✗ Error verifying piece {piece_index}: {e}")
+    
+    async def send_hash_request(self, root, base_layer, index, length, proof_layers):
+        """BEP 52 hash request: <len=49><id=21><pieces root><base layer><index><length><proof layers>"""
+        key = (root, base_layer, index)
+        self.piece_manager.hash_requests.add(key)
+        self.sent_hash_requests.add(key)
+        self.send_message(struct.pack('>IB32sIIII', 49, 21, root, base_layer, index, length, proof_layers))
+        await self.drain_outbound()
+    
+    def fail_block_hash_request(self, key):
+        """No leaf hashes coming for a failed piece (rejected, timed out, disconnected): refetch all of it"""
+        piece_index = self.block_hash_requests.pop(key)[0]
+        self.sent_hash_requests.discard(key)
+        self.piece_manager.hash_requests.discard(key)
+        if piece_index not in self.piece_manager.downloaded_pieces:
+            print(f"🔁 No block hashes for piece {piece_index} - refetching the whole piece")
+            self.piece_manager.refetch_piece(piece_index)
+    
+    async def request_missing_layers(self):
+        """Ask this peer for piece layers the torrent file didn't include"""
+        if not self.supports_v2 or not self.piece_manager or not self.piece_manager.missing_layers:
+            return
+        for request in self.piece_manager.get_layer_hash_requests():
+            await self.send_hash_request(*request)
+    
     async def save_to_file(self, piece_index, offset, data):
         #"""Save downloaded data to file"""
         try:
@@ -657,12 +2292,218 @@ class PeerProtocol:
         except Exception as e:
             print(f"✗ Error saving to file: {e}")
 
+# This class is added to download pieces from HTTP mirrors listed in the torrent (web seeds)
+class WebSeed:
+    def __init__(self, url, torrent_parser, piece_manager, file_writer=None, memory_budget=None,
+                 progress_tracker=None, throttle=None, max_in_flight=WEB_SEED_MAX_IN_FLIGHT):
+        self.url = url
+        self.parser = torrent_parser
+        self.piece_manager = piece_manager
+        self.file_writer = file_writer
+        self.memory_budget = memory_budget
+        self.progress_tracker = progress_tracker
+        self.throttle = throttle  # Callable: True while the P2P swarm alone is fast enough
+        self.max_in_flight = max_in_flight
+        self.files = torrent_parser.get_files()
+        self.file_offsets = [f['offset'] for f in self.files]
+        self.session = None
+        self.executor = None
+        self.active = True
+        self.failures = 0
+        self.bytes_downloaded = 0
+    
+    def get_session(self):
+        if self.session is None:
+            # Pool sized to the in-flight limit so every range request reuses a keep-alive connection
+            import requests
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='web-seed')
+        return self.session
+    
+    def get_file_url(self, file):
+        """BEP 19: single-file torrents use the URL as-is unless it ends in '/'"""
+        name = self.parser.metadata[b'info'][b'name'].decode('utf-8', errors='ignore')
+        if len(self.files) == 1 and file['path'] == name:
+            return self.url + quote(name) if self.url.endswith('/') else self.url
+        base = self.url if self.url.endswith('/') else self.url + '/'
+        return base + '/'.join(quote(part) for part in file['path'].split(os.sep))
+    
+    def fetch_range(self, file, start, end):
+        """GET bytes [start, end) of one file (runs on a worker thread)"""
+        # Streamed, so a server that ignores the range can't make us buffer the whole file
+        with self.get_session().get(
+            self.get_file_url(file),
+            headers={'Range': f'bytes={start}-{end - 1}'},
+            timeout=30,
+            stream=True
+        ) as response:
+            if response.status_code == 206:
+                data = response.content
+            elif response.status_code == 200 and start == 0:
+                # Server ignored the range: keep the head of the file, drop the rest of the body
+                data = bytearray()
+                for chunk in response.iter_content(chunk_size=WEB_SEED_READ_SIZE):
+                    data += chunk
+                    if len(data) >= end:
+                        break
+                data = bytes(data[:end])
+            elif response.status_code == 200:
+                raise IOError("server ignored the range request")
+            else:
+                raise IOError(f"HTTP {response.status_code}")
+        if len(data) != end - start:
+            raise IOError(f"short read: {len(data)}/{end - start} bytes")
+        return data
+    
+    def fetch_data(self, offset, length):
+        """Fetch torrent-wide bytes, one range request per file touched"""
+        data = bytearray(length)
+        pos = offset
+        end = offset + length
+        while pos < end:
+            file_index = bisect_right(self.file_offsets, pos) - 1
+            file = self.files[file_index]
+            segment_end = min(end, file['offset'] + file['length'])
+            if segment_end <= pos:
+                # Gap after a v2 file: zeros, like pad files
+                if file_index + 1 >= len(self.files):
+                    break
+                pos = min(end, self.file_offsets[file_index + 1])
+                continue
+            if not file['pad']:
+                chunk = self.fetch_range(file, pos - file['offset'], segment_end - file['offset'])
+                data[pos - offset:segment_end - offset] = chunk
+            pos = segment_end
+        return bytes(data)
+    
+    def next_job(self):
+        """Work from the shared piece picker: reassigned blocks first, then a whole piece"""
+        block = self.piece_manager.take_orphan_block()
+        if block:
+            return block
+        picked = self.piece_manager.pick_pieces(1)
+        if not picked:
+            return None
+        piece_index = picked[0]
+        self.piece_manager.claim_piece(piece_index)
+        return (piece_index, 0, self.piece_manager.pieces[piece_index]['size'])
+    
+    async def run(self):
+        """Download until all wanted pieces are in, with several ranges in flight"""
+        print(f"🌐 Web seed: {self.url}")
+        workers = [asyncio.create_task(self.worker(slot)) for slot in range(self.max_in_flight)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.close()
+    
+    async def worker(self, slot):
+        loop = asyncio.get_running_loop()
+        self.get_session()
+        while self.active and not self.piece_manager.all_wanted_downloaded():
+            # Leave the bandwidth to peers while the swarm is fast on its own
+            if slot > 0 and self.throttle and self.throttle():
+                await asyncio.sleep(1)
+                continue
+            if self.memory_budget:
+                await self.memory_budget.wait_for_room()
+            
+            job = self.next_job()
+            if job is None:
+                await asyncio.sleep(0.5)  # Everything left is in flight elsewhere
+                continue
+            piece_index, begin, length = job
+            offset = piece_index * self.piece_manager.piece_length + begin
+            
+            if self.memory_budget:
+                self.memory_budget.reserve('receive', length)
+            try:
+                data = await loop.run_in_executor(self.executor, self.fetch_data, offset, length)
+                self.failures = 0
+                await self.store(piece_index, begin, data)
+            except Exception as e:
+                self.failures += 1
+                print(f"✗ Web seed {self.url} failed ({self.failures}/{WEB_SEED_MAX_FAILURES}): {e}")
+                self.return_job(piece_index, begin, length)
+                if self.failures >= WEB_SEED_MAX_FAILURES:
+                    print(f"❌ Giving up on web seed {self.url}")
+                    self.active = False
+                    break
+                await asyncio.sleep(min(30, 2 ** self.failures))
+            finally:
+                if self.memory_budget:
+                    self.memory_budget.release('receive', length)
+    
+    def return_job(self, piece_index, begin, length):
+        blocks = [(piece_index, block_begin, min(MERKLE_BLOCK_SIZE, begin + length - block_begin))
+                  for block_begin in range(begin, begin + length, MERKLE_BLOCK_SIZE)]
+        self.piece_manager.return_blocks(blocks)
+    
+    async def store(self, piece_index, begin, data):
+        """Feed fetched data through the same block bookkeeping and verification as peers"""
+        self.bytes_downloaded += len(data)
+        if self.progress_tracker:
+            self.progress_tracker.update(len(data))
+        piece_start = piece_index * self.piece_manager.piece_length
+        complete = False
+        for block_offset in range(0, len(data), MERKLE_BLOCK_SIZE):
+            block = data[block_offset:block_offset + MERKLE_BLOCK_SIZE]
+            if self.file_writer:
+                self.file_writer.queue_write(piece_index, block, piece_start + begin + block_offset)
+            if self.piece_manager.mark_block_received(piece_index, begin + block_offset, len(block)):
+                complete = True
+        print(f"🌐 Web seed delivered piece {piece_index}, offset {begin}, {len(data)} bytes")
+        if complete:
+            await self.verify_piece(piece_index)
+    
+    async def verify_piece(self, piece_index):
+        if self.file_writer:
+            result = await self.file_writer.verify_piece(self.piece_manager, piece_index)
+        else:
+            result = {'ok': True}
+        status = self.piece_manager.apply_verification(piece_index, result)
+        if status == 'verified':
+            print(f"✅ Piece {piece_index} verified (web seed)")
+        elif status == 'need_hashes':
+            # No hash requests over HTTP - fetch the whole piece again
+            self.piece_manager.refetch_piece(piece_index)
+            print(f"✗ Piece {piece_index} from web seed failed hash check - refetching")
+        elif status == 'bad_blocks':
+            print(f"✗ Piece {piece_index} from web seed failed hash check - refetching bad blocks")
+    
+    def close(self):
+        if self.session:
+            self.session.close()
+            self.session = None
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
 class BitTorrentClient:
-    def __init__(self, torrent_file):
+    def __init__(self, torrent_file, file_priorities=None, memory_limit=DEFAULT_MEMORY_LIMIT,
+                 lsd_interface=LSD_INTERFACE):
         self.torrent_file = torrent_file
+        self.file_priorities = file_priorities or {}  # file index -> priority
+        self.memory_budget = MemoryBudget(memory_limit)
+        self.web_seeds = []
+        self.web_seed_tasks = []
+        self.p2p_rate_sample = (time.time(), 0)  # (time, bytes from peers) for web seed throttling
+        self.p2p_rate = 0
         self.parser = TorrentParser(torrent_file)
         self.tracker = None
         self.peer_protocols = []
+        self.peer_tasks = set()  # Running peer sessions (connect_to_peer lasts the whole session)
+        self.peer_stats = PeerStats()
+        self.server = None  # Dual-stack listening socket for incoming peers
+        self.lsd_interface = lsd_interface
+        self.local_discovery = None
+        self.lan_peers = []  # (ip, port) found by Local Service Discovery, dialed first
+        self.download_started = False
         # Initialize managers early
         self.piece_manager = None
         self.file_writer = None
@@ -720,6 +2561,15 @@ class BitTorrentClient:
         
         successful = sum(1 for p in self.peer_protocols if p.connected)
         print(f"Successful connections: {successful}")
+        snubbed = sum(1 for p in self.peer_protocols if p.snubbed)
+        print(f"Snubbed peers: {snubbed}")
+        messages = sum(p.messages_sent for p in self.peer_protocols)
+        writes = sum(p.write_calls for p in self.peer_protocols)
+        print(f"Outbound messages: {messages} in {writes} socket writes")
+        for family, stats in self.peer_stats.get_stats().items():
+            connect_time = f"{stats['connect_time'] * 1000:.0f} ms" if stats['connect_time'] is not None else "n/a"
+            print(f"{family.upper()}: {stats['known']} known, {stats['connected']}/{stats['attempted']} connected, "
+                  f"{stats['incoming']} incoming, {stats['downloaded_mb']:.1f} MB, connect time {connect_time}")
         
         if successful == 0:
             print("🔍 DIAGNOSIS: Network is blocking P2P protocols")
@@ -737,46 +2587,71 @@ class BitTorrentClient:
         
         # Initialize download components
         self.piece_manager = PieceManager(self.parser)
-        self.file_writer = FileWriter(self.parser, client=self)  # Pass self as client for progress tracking
+        for file_index, priority in self.file_priorities.items():
+            self.piece_manager.set_file_priority(file_index, priority)
+        self.file_writer = FileWriter(self.parser, client=self, piece_manager=self.piece_manager,
+                                      memory_budget=self.memory_budget)  # Pass self as client for progress tracking
         self.progress_tracker = ProgressTracker(
-            self.parser.get_file_size(),
+            self.piece_manager.get_wanted_size(),
             len(self.piece_manager.pieces)
         )
         
         self.tracker = Tracker(self.parser)
+        self.web_seeds = [
+            WebSeed(url, self.parser, self.piece_manager, self.file_writer, self.memory_budget,
+                    self.progress_tracker, throttle=self.is_swarm_fast)
+            for url in self.parser.get_url_list()
+        ]
         
-        # Step 2: Contact tracker
+        # Step 2: Contact tracker (LAN peers answer our multicast announce meanwhile)
+        lsd_ok = await self.start_local_discovery()
         print("\n📡 Contacting tracker...")
-        if not self.tracker.contact_tracker():
+        tracker_ok = self.tracker.contact_tracker()
+        if not tracker_ok:
             print("✗ Failed to get peers from tracker")
-            return
-        
-        if not self.tracker.peers:
+        elif not self.tracker.peers:
             print("✗ No peers found")
+        swarm_peers = tracker_ok and bool(self.tracker.peers)
+        if not swarm_peers and not self.lan_peers and not self.web_seeds and not lsd_ok:
             return
         
-        # Step 3: Connect to peers
-        peers_to_try = self.tracker.get_best_peers(25)
+        # Step 3: Connect to peers, LAN peers first and on top of the peer limit
+        for peer in self.tracker.peers:
+            self.peer_stats.add_known(self.tracker.get_peer_addresses(peer))
+        peers_to_try = self.tracker.get_best_peers(25, self.peer_stats.preferred_family())
         # Use only real peers (no localhost)
-        local_peers = peers_to_try
+        local_peers = [peer for peer in peers_to_try if peer not in self.lan_peers]
 
-        print(f"🔗 Connecting to {len(local_peers)} selected peers (including localhost)...")
-        tasks = []
+        # Peers send blocks right after the handshake, so the files must exist by then;
+        # LAN peers found from here on are dialed by add_lan_peer as they answer
+        lan_peers = list(self.lan_peers)
+        await self.prepare_download()
+        # Web seeds share the piece picker with the peers from the start
+        self.start_web_seeds()
+        if not swarm_peers and not lan_peers and self.web_seeds:
+            print(f"🌐 Downloading from {len(self.web_seeds)} web seed(s) only")
+            await self.start_actual_download()
+            return
+        if lan_peers or local_peers:
+            print(f"🔗 Connecting to {len(lan_peers)} LAN + {len(local_peers)} selected peers...")
+        else:
+            print("🏠 Waiting for LAN peers...")
+        for peer in lan_peers:
+            self.start_peer_task(self.connect_lan_peer(peer))
         for ip, port in local_peers:
-            protocol = PeerProtocol(
-                self.parser.get_info_hash(),
-                self.tracker.generate_peer_id(),
-                self.file_writer,
-                self.piece_manager
-            )
+            protocol = self.create_peer_protocol()
             self.peer_protocols.append(protocol)
-            task = asyncio.create_task(protocol.connect_to_peer(ip, port))
-            tasks.append(task)
+            alternates = self.tracker.get_peer_addresses((ip, port))[1:]
+            self.start_peer_task(protocol.connect_to_peer(ip, port, alternates))
         
-        # Wait for connections with timeout
-        try:
-            await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout=30)
-        except asyncio.TimeoutError:
+        # Wait for the first connection; the sessions keep running in the background.
+        # Without tracker peers, give a rate-limited LAN answer time to arrive
+        discovery_wait = (LSD_DISCOVERY_WAIT + (0 if swarm_peers else LSD_MIN_ANNOUNCE_INTERVAL)) if lsd_ok else 0
+        if not await self.wait_for_connection(timeout=30, discovery_wait=discovery_wait):
+            if not self.peer_protocols:
+                print("✗ No LAN peers found")
+                self.file_writer.close()
+                return
             print("⚠ Connection timeout")
         
         # Step 4: Show connection results
@@ -784,9 +2659,12 @@ class BitTorrentClient:
         print(f"\n📊 Connection Summary:")
         print(f"  Total peers attempted: {len(self.peer_protocols)}")
         print(f"  Successfully connected: {connected_peers}")
+        for family in ('ipv4', 'ipv6'):
+            family_peers = [p for p in self.peer_protocols if p.connected and p.family == family]
+            print(f"  {family.upper()}: {len(family_peers)} connected")
         
         # Step 5: Start download or simulation
-        if connected_peers > 0:
+        if connected_peers > 0 or self.web_seeds or self.all_pieces_downloaded():
             print("\n🔄 Starting actual download...")
             await self.start_actual_download()
         else:
@@ -800,6 +2678,113 @@ class BitTorrentClient:
         
         print("\n✅ Demo completed successfully!")
     
+    def start_peer_task(self, coroutine):
+        """Run a peer session in the background, keeping a reference until it ends"""
+        task = asyncio.create_task(coroutine)
+        self.peer_tasks.add(task)
+        task.add_done_callback(self.peer_tasks.discard)
+        return task
+
+    def start_web_seeds(self):
+        if not self.web_seed_tasks:
+            self.web_seed_tasks = [asyncio.create_task(web_seed.run()) for web_seed in self.web_seeds]
+
+    def has_live_sources(self):
+        """Anything that may still deliver pieces: a peer session, a connected peer or a web seed"""
+        return (bool(self.peer_tasks) or any(p.connected for p in self.peer_protocols)
+                or any(not task.done() for task in self.web_seed_tasks))
+
+    async def wait_for_connection(self, timeout, discovery_wait=0):
+        """Until a peer is connected (True), or the time is up / every attempt ended (False).
+        For the first discovery_wait seconds, LAN peers may still turn up with no attempt running"""
+        start = time.time()
+        while time.time() - start < timeout:
+            if any(p.connected for p in self.peer_protocols):
+                return True
+            if self.all_pieces_downloaded():
+                return False
+            if not self.peer_tasks and time.time() - start >= discovery_wait:
+                return False
+            await asyncio.sleep(0.1)
+        return False
+
+    async def prepare_download(self):
+        """Create the files, then accept incoming and LAN peers"""
+        download_path = self.file_writer.initialize_file()
+        if not self.download_started:
+            self.download_started = True
+            # Swarm peers that found us through the tracker can connect from now on
+            if await self.start_listening() and self.local_discovery:
+                self.local_discovery.announce(force=True)
+        return download_path
+
+    def create_peer_protocol(self):
+        return PeerProtocol(
+            self.parser.get_info_hash(),
+            self.tracker.generate_peer_id(),
+            self.file_writer,
+            self.piece_manager,
+            self.memory_budget,
+            self.peer_stats
+        )
+
+    async def start_listening(self, port=LISTEN_PORT):
+        """Accept incoming peers on every IPv4 and IPv6 address (one socket per family)"""
+        try:
+            self.server = await asyncio.start_server(self.handle_incoming_peer, port=port,
+                                                     limit=RECEIVE_BUFFER_LIMIT)
+        except OSError as e:
+            print(f"⚠ Not accepting incoming peers, port {port} unavailable: {e}")
+            return False
+        families = sorted({family_of(sock.getsockname()[0]) for sock in self.server.sockets})
+        print(f"👂 Listening for incoming peers on port {port} ({', '.join(families)})")
+        return True
+
+    async def handle_incoming_peer(self, reader, writer):
+        protocol = self.create_peer_protocol()
+        self.peer_protocols.append(protocol)
+        await protocol.accept_connection(reader, writer)
+
+    def stop_listening(self):
+        if self.server:
+            self.server.close()
+            self.server = None
+        if self.local_discovery:
+            self.local_discovery.close()
+            self.local_discovery = None
+
+    async def start_local_discovery(self):
+        self.local_discovery = LocalServiceDiscovery([self.parser.get_info_hash()], LISTEN_PORT,
+                                                     self.add_lan_peer, self.lsd_interface)
+        if not await self.local_discovery.start():
+            self.local_discovery = None
+            return False
+        return True
+
+    def add_lan_peer(self, ip, port, info_hash):
+        """Local Service Discovery callback: LAN peers jump the queue"""
+        if info_hash != self.parser.get_info_hash() or (ip, port) in self.lan_peers:
+            return
+        print(f"🏠 LAN peer {ip}:{port} discovered")
+        self.lan_peers.append((ip, port))
+        self.peer_stats.add_known([(ip, port)])
+        if self.download_started:
+            self.start_peer_task(self.connect_lan_peer((ip, port)))
+
+    async def connect_lan_peer(self, peer):
+        protocol = self.create_peer_protocol()
+        self.peer_protocols.append(protocol)
+        return await protocol.connect_to_peer(*peer, direct=True)
+
+    async def run_session(self):
+        """The whole download, closing the listening sockets afterwards"""
+        try:
+            await self.start_download()
+        finally:
+            self.stop_listening()
+            for task in list(self.peer_tasks) + self.web_seed_tasks:
+                task.cancel()
+
     async def start_actual_download(self):
         """Start the actual file download process"""
         print("\n" + "="*50)
@@ -807,28 +2792,29 @@ class BitTorrentClient:
         print("="*50)
         
         # Create download file
-        download_path = self.file_writer.initialize_file()
+        download_path = await self.prepare_download()
         print(f"📁 Downloading to: {download_path}")
         
         # Show initial progress
         progress = self.progress_tracker.get_progress()
         print(f"📊 Initial: {progress['pieces_done']}/{progress['total_pieces']} pieces, {progress['percent']:.1f}%")
         
-        # Start downloading from connected peers
-        download_tasks = []
-        for protocol in self.peer_protocols:
-            if protocol.connected:
-                task = self.download_from_peer(protocol)
-                download_tasks.append(task)
+        # Peers (already connected or still connecting) and web seeds share the piece picker
+        self.start_web_seeds()
         
         # Wait for download completion with timeout
         try:
-            await asyncio.wait_for(asyncio.gather(*download_tasks), timeout=60)
+            await asyncio.wait_for(self.monitor_download(), timeout=60)
             print("✅ Download tasks completed!")
         except asyncio.TimeoutError:
             print("⚠ Download timeout reached")
         except Exception as e:
             print(f"✗ Download error: {e}")
+        finally:
+            for task in self.web_seed_tasks:
+                task.cancel()
+            for web_seed in self.web_seeds:
+                web_seed.close()
         
         # Final progress update
         progress = self.progress_tracker.get_progress()
@@ -838,47 +2824,85 @@ class BitTorrentClient:
         self.file_writer.close()
         print("💾 File writer closed")
 
-    async def download_from_peer(self, protocol):
-        """Download pieces from a specific peer"""
+    async def monitor_download(self):
+        """Report progress until every wanted piece is in or no peer or web seed is left"""
         try:
-            print(f"🔗 Starting download from peer...")
-            
-            # Give the peer a moment to start its download process
-            await asyncio.sleep(2)
-            
             # Monitor download progress
             while not self.all_pieces_downloaded():
+                if not self.has_live_sources():
+                    print("⚠ No peers or web seeds left")
+                    break
                 await asyncio.sleep(1)  # Check every second
                 
                 # Show progress periodically
-                progress = self.progress_tracker.get_progress()
-                if progress['pieces_done'] % 5 == 0:  # Every 5 pieces
-                    print(f"📊 Progress: {progress['percent']:.1f}% - {progress['speed_kbps']:.1f} KB/s")
-                
-            print(f"✅ All pieces downloaded from peer")
+                stats = self.get_stats()
+                if stats['pieces_done'] % 5 == 0:  # Every 5 pieces
+                    memory = stats['memory']
+                    print(f"📊 Progress: {stats['percent']:.1f}% - {stats['speed_kbps']:.1f} KB/s"
+                          f" - buffers {memory['used_mb']:.1f}/{memory['limit_mb']:.0f} MB")
+            
+            if self.all_pieces_downloaded():
+                print(f"✅ All pieces downloaded")
                 
         except Exception as e:
-            print(f"Download from peer failed: {e}")
+            print(f"Download monitor failed: {e}")
+
+    def get_stats(self):
+        """Progress plus memory budget usage and per-family peer statistics"""
+        stats = self.progress_tracker.get_progress() if self.progress_tracker else {}
+        stats['memory'] = self.memory_budget.get_stats()
+        stats['peers'] = self.peer_stats.get_stats()
+        return stats
+
+    def is_swarm_fast(self):
+        """True while peers alone deliver more than WEB_SEED_P2P_FAST_RATE (re-sampled once a second)"""
+        if not self.progress_tracker:
+            return False
+        now = time.time()
+        p2p_bytes = self.progress_tracker.downloaded_size - sum(ws.bytes_downloaded for ws in self.web_seeds)
+        last_time, last_bytes = self.p2p_rate_sample
+        if now - last_time >= 1:
+            self.p2p_rate = (p2p_bytes - last_bytes) / (now - last_time)
+            self.p2p_rate_sample = (now, p2p_bytes)
+        return self.p2p_rate > WEB_SEED_P2P_FAST_RATE
 
     def get_next_piece(self):
         """Get the next piece that needs downloading"""
         if not self.piece_manager:
             return None
-        for piece in self.piece_manager.pieces:
-            if not piece['downloaded']:
-                return piece
-        return None
+        picked = self.piece_manager.pick_pieces(1)
+        return self.piece_manager.pieces[picked[0]] if picked else None
 
     def all_pieces_downloaded(self):
-        """Check if all pieces are downloaded"""
+        """Check if all wanted pieces are downloaded"""
+        if not self.piece_manager:
+            return False
+        return self.piece_manager.all_wanted_downloaded()
+
+    def list_files(self):
+        """Show the torrent's files with their index and priority"""
+        for i, file in enumerate(self.piece_manager.files):
+            priority = self.piece_manager.file_priorities[i]
+            print(f"  [{i}] {file['path']} ({file['length'] / 1024 / 1024:.1f} MB) priority={priority}")
+
+    def set_file_priority(self, file_index, priority):
+        """Change a file's priority while the download is running"""
         if not self.piece_manager:
+            # Not started yet - applied once the torrent is parsed
+            self.file_priorities[file_index] = priority
+            return True
+        if not self.piece_manager.set_file_priority(file_index, priority):
             return False
-        return all(piece['downloaded'] for piece in self.piece_manager.pieces)
+        if self.file_writer:
+            self.file_writer.queue_priorities()
+        if self.progress_tracker:
+            self.progress_tracker.total_size = self.piece_manager.get_wanted_size()
+        return True
     
     def download(self):
         """Main method to start the download process"""
         try:
-            asyncio.run(self.start_download())
+            asyncio.run(self.run_session())
         except KeyboardInterrupt:
             print("\n⏹ Download cancelled by user")
             if self.file_writer:
@@ -888,18 +2912,60 @@ class BitTorrentClient:
             if self.file_writer:
                 self.file_writer.close()
 
+def create_torrent(args):
+    """`--create`: hash a file or directory into a .torrent"""
+    try:
+        creator = TorrentCreator(args.create, args.announce, args.web_seed, args.piece_length,
+                                 args.private, args.comment)
+    except (OSError, ValueError) as e:
+        print(f"✗ Cannot create torrent: {e}")
+        return False
+    output = args.output or os.path.basename(creator.path) + '.torrent'
+    print(f"🔨 Creating {output}: {len(creator.files)} file(s), {creator.total_size / 1024 / 1024:.1f} MB, "
+          f"{creator.num_pieces} pieces of {creator.piece_length // 1024} KB, {creator.workers} worker(s)")
+    started = time.time()
+    
+    def progress(hashed, total):
+        elapsed = max(time.time() - started, 1e-6)
+        percent = hashed / total * 100 if total else 100
+        print(f"   {percent:5.1f}% - {hashed / elapsed / 1024 / 1024:.1f} MB/s", end='\r', flush=True)
+    
+    try:
+        info_hash = creator.save(output, progress)
+    except OSError as e:
+        print(f"\n✗ Cannot create torrent: {e}")
+        return False
+    print(f"\n✅ Torrent created in {time.time() - started:.1f}s: {output} (info hash {info_hash.hex()})")
+    return True
+
 def main():
+    arg_parser = argparse.ArgumentParser(description="Simple BitTorrent Client")
+    arg_parser.add_argument('torrent', nargs='?', help="path to a .torrent file (prompted for if omitted)")
+    arg_parser.add_argument('--diagnose', action='store_true', help="run network diagnostics first")
+    arg_parser.add_argument('--no-cache', action='store_true', help="ignore cached diagnostics results")
+    create_group = arg_parser.add_argument_group('torrent creation')
+    create_group.add_argument('--create', metavar='PATH', help="create a .torrent from a file or directory")
+    create_group.add_argument('-o', '--output', help="where to write the .torrent (default: <name>.torrent)")
+    create_group.add_argument('--announce', action='append', default=[], metavar='URL',
+                              help="tracker URL, repeat for more tiers")
+    create_group.add_argument('--web-seed', action='append', default=[], metavar='URL', help="url-list entry")
+    create_group.add_argument('--piece-length', type=int, help="bytes per piece (default: automatic)")
+    create_group.add_argument('--private', action='store_true', help="set the private flag")
+    create_group.add_argument('--comment')
+    args = arg_parser.parse_args()
+    
+    if args.create:
+        sys.exit(0 if create_torrent(args) else 1)
+    
     print("🧲 Simple BitTorrent Client - TURBO MODE")
-    print("Running comprehensive network tests...")
-    test_outgoing_connection()
-    test_alternative_connectivity() 
-    test_raw_socket_connectivity()
-    print()
+    if args.diagnose:
+        run_network_diagnostics(use_cache=not args.no_cache)
+        print()
     
     print("Note: This is a DEMO version that shows the connection process.")
     print("It connects to peers but doesn't actually download files.\n")
     
-    torrent_file = input("Enter path to .torrent file (or press Enter for demo): ").strip()
+    torrent_file = args.torrent or input("Enter path to .torrent file (or press Enter for demo): ").strip()
     
     if not torrent_file:
         print("❌ Please provide a torrent file path.")